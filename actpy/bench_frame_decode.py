@@ -0,0 +1,66 @@
+import time
+import zlib
+import numpy as np
+
+from model.config import FRAME_WIDTH, FRAME_HEIGHT
+from model.frame_decoder import FrameDecoder
+
+## ==================================================================
+## Reference Implementation (previous frame_reader path)
+## ==================================================================
+
+def _unpack_4bit_to_8bit_loop(packed_array):
+    unpacked_size = 2 * len(packed_array)
+    unpacked_array = np.zeros(unpacked_size, dtype=np.uint8)
+
+    for i, val in enumerate(packed_array):
+        pixel1 = (val & 0xF0) >> 4
+        pixel2 = val & 0x0F
+        unpacked_array[2*i] = pixel1 << 4
+        unpacked_array[2*i + 1] = pixel2 << 4
+
+    return unpacked_array
+
+def _decode_loop(compressed):
+    packet_data = zlib.decompress(compressed)
+    chunk8bit = _unpack_4bit_to_8bit_loop(packet_data)
+    return np.reshape(chunk8bit, (FRAME_HEIGHT, FRAME_WIDTH))
+
+## ==================================================================
+## Benchmark
+## ==================================================================
+
+def _make_compressed_frame():
+    # Smooth gradient with some noise, roughly as compressible as a game frame
+    y, x = np.mgrid[0:FRAME_HEIGHT, 0:FRAME_WIDTH]
+    frame = ((x + y) % 256).astype(np.uint8)
+    noise = np.random.default_rng(0).integers(0, 32, size=frame.shape, dtype=np.uint8)
+    frame = (frame | noise) & 0xF0
+    packed = (frame.reshape(-1, 2)[:, 0] & 0xF0) | (frame.reshape(-1, 2)[:, 1] >> 4)
+    return frame, zlib.compress(packed.tobytes())
+
+def _time_per_call(fn, arg, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(arg)
+    return (time.perf_counter() - start) / repeats
+
+def main():
+    frame, compressed = _make_compressed_frame()
+    decoder = FrameDecoder()
+
+    # Both paths must produce the same frame
+    assert np.array_equal(_decode_loop(compressed), frame)
+    assert np.array_equal(decoder.decode(compressed), frame)
+
+    loop_time = _time_per_call(_decode_loop, compressed, 5)
+    fast_time = _time_per_call(decoder.decode, compressed, 500)
+    zlib_time = _time_per_call(zlib.decompress, compressed, 500)
+
+    print(f"Frame: {FRAME_WIDTH}x{FRAME_HEIGHT}, compressed {len(compressed)} bytes")
+    print(f"zlib.decompress only: {zlib_time * 1000:.3f} ms")
+    print(f"Python loop decode:   {loop_time * 1000:.3f} ms")
+    print(f"LUT decode:           {fast_time * 1000:.3f} ms ({loop_time / fast_time:.0f}x faster)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import time
+import argparse
+import numpy as np
+
+from model.config import FRAME_WIDTH, FRAME_HEIGHT, FRAMES_PER_STEP, Actions, INFERENCE_WEIGHTS_FILE
+from model.nn import load_or_build_model
+from model.numpy_inference import NumpyInferenceModel
+from model.checkpoints import save_weights_file
+
+## ==================================================================
+## Benchmark
+## ==================================================================
+
+def _make_inputs(batch, rng):
+    frames = (rng.integers(0, 16, size=(batch, FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP)) << 4).astype(np.uint8)
+    action_states = rng.integers(0, 2, size=(batch, Actions._SIZE)).astype(np.uint8)
+    return [frames, action_states]
+
+def _time_per_call(fn, inputs, repeats):
+    fn(inputs) # warm up, builds graphs and buffers
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(inputs)
+    return (time.perf_counter() - start) / repeats
+
+def main(batch, repeats, export):
+    rng = np.random.default_rng(0)
+    model = load_or_build_model()
+    numpy_model = NumpyInferenceModel(model.get_weights())
+
+    if export:
+        save_weights_file(model.get_weights(), INFERENCE_WEIGHTS_FILE)
+        print(f"Exported weights to {INFERENCE_WEIGHTS_FILE}")
+
+    # Both paths must produce the same Q-values
+    inputs = _make_inputs(batch, rng)
+    expected = np.asarray(model.predict_on_batch(inputs))
+    actual = numpy_model.predict_on_batch(inputs)
+    error = np.max(np.abs(expected - actual)) / max(np.max(np.abs(expected)), 1e-6)
+    print(f"Max relative error vs Keras: {error:.2e}")
+    assert np.allclose(expected, actual, rtol=1e-3, atol=1e-4 * max(np.max(np.abs(expected)), 1))
+    assert np.array_equal(np.argmax(expected, axis=1), np.argmax(actual, axis=1))
+
+    predict_time = _time_per_call(lambda x: model.predict(x, verbose=0), inputs, repeats)
+    predict_on_batch_time = _time_per_call(model.predict_on_batch, inputs, repeats)
+    numpy_time = _time_per_call(numpy_model.predict_on_batch, inputs, repeats)
+
+    print(f"Batch {batch}, frames {FRAME_WIDTH}x{FRAME_HEIGHT}x{FRAMES_PER_STEP}")
+    print(f"Keras predict:          {predict_time * 1000:.3f} ms")
+    print(f"Keras predict_on_batch: {predict_on_batch_time * 1000:.3f} ms")
+    print(f"NumPy inference:        {numpy_time * 1000:.3f} ms ({predict_time / numpy_time:.1f}x faster than predict)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the NumPy inference model with Keras")
+    parser.add_argument("--batch", type=int, default=1, help="samples per call")
+    parser.add_argument("--repeats", type=int, default=50, help="timed calls per backend")
+    parser.add_argument("--export", action="store_true", help=f"also write the weights to {INFERENCE_WEIGHTS_FILE}")
+    args = parser.parse_args()
+    main(args.batch, args.repeats, args.export)
@@ -0,0 +1,149 @@
+import queue
+import threading
+
+from model.config import CHANNEL_BLOCK_TIMEOUT
+
+## ==================================================================
+## Overflow Policies
+## ==================================================================
+
+class Overflow:
+    DROP_OLDEST = 0 # latest wins, the oldest queued message is discarded
+    BLOCK = 1       # the producer waits for room, discarded only once the pipeline stops
+    COALESCE = 2    # queued messages with the same key collapse to the newest one
+    _SIZE = 3
+
+def message_addr(message):
+    # coalescing key of (addr, ...) messages
+    return message[0]
+
+## ==================================================================
+## Bounded Channel
+## ==================================================================
+
+class Channel:
+    # Bounded Manager queue with an overflow policy. Same get/put interface
+    # as the queue so consumers do not change. Overflows are counted on the
+    # producer side, in each process that puts into the channel.
+
+    def __init__(self, manager, name, capacity, policy, key=None, stop_event=None):
+        if policy == Overflow.COALESCE and key is None:
+            raise Exception(f"Channel {name}: coalescing needs a key function")
+        if policy == Overflow.BLOCK and stop_event is None:
+            raise Exception(f"Channel {name}: blocking needs the stop event")
+        self.name = name
+        self.capacity = capacity
+        self.policy = policy
+        self.key = key # module level function, channels are pickled into processes
+        self.stop_event = stop_event
+        self.queue = manager.Queue(maxsize=capacity)
+        self.overflows = 0
+
+    ## Producer
+    ## ------------------------------------------------------------------
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == Overflow.BLOCK:
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=CHANNEL_BLOCK_TIMEOUT)
+                    return
+                except queue.Full:
+                    pass
+            self.overflows += 1
+            return
+
+        if self.policy == Overflow.COALESCE:
+            self._coalesce()
+
+        # make room by discarding the oldest, other producers may refill it first
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                self.overflows += 1
+            except queue.Empty:
+                pass
+
+    def _coalesce(self):
+        # drain, keep the newest message of each key in arrival order, refill
+        latest = {}
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            key = self.key(item)
+            if key in latest:
+                del latest[key]
+                self.overflows += 1
+            latest[key] = item
+        for item in latest.values():
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.overflows += 1
+
+    ## Consumer
+    ## ------------------------------------------------------------------
+
+    def get(self, block=True, timeout=None):
+        return self.queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def empty(self):
+        return self.queue.empty()
+
+## ==================================================================
+## Background Sender
+## ==================================================================
+
+class ChannelSender:
+    # Puts into a blocking channel from a thread of the producer process, so
+    # the backpressure of a slow consumer holds this thread, not the caller.
+    # The caller never waits: when `capacity` messages are already waiting,
+    # the new one is discarded and counted as an overflow of the sender.
+
+    def __init__(self, channel, capacity):
+        self.channel = channel
+        self.name = f"{channel.name}_sender"
+        self.pending = queue.Queue(maxsize=capacity)
+        self.overflows = 0
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        try:
+            self.pending.put_nowait(item)
+        except queue.Full:
+            self.overflows += 1
+
+    def qsize(self):
+        return self.pending.qsize()
+
+    def close(self):
+        # sends what is still pending, the channel stops blocking once the pipeline stops
+        self.pending.put(None)
+        self.thread.join()
+
+    def _send_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            self.channel.put(item)
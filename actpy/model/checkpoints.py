@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+from model.config import CHECKPOINT_DIR, CHECKPOINT_KEEP_LAST, CHECKPOINT_KEEP_BEST, CHECKPOINT_QUEUE_SIZE
+
+## ==================================================================
+## Weights File
+## ==================================================================
+
+def save_weights_file(weights, path):
+    # compact float32 npz of the Keras weight list, written atomically
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, *[np.asarray(w, dtype=np.float32) for w in weights])
+    os.replace(tmp_path, path)
+
+def load_weights_file(path):
+    with np.load(path) as data:
+        return [data[f"arr_{i}"] for i in range(len(data.files))]
+
+## ==================================================================
+## Manifest
+## ==================================================================
+
+# A checkpoint directory holds one npz per checkpoint (the Keras weight
+# list, same format as the NumPy inference weights) and a json manifest
+# listing them in step order. Files are renamed into place only once
+# complete, the manifest is replaced after the file exists.
+CHECKPOINT_MANIFEST_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+def _checkpoint_file(step):
+    return f"checkpoint_{step:09d}.npz"
+
+def read_manifest(directory=CHECKPOINT_DIR):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest["version"] == CHECKPOINT_MANIFEST_VERSION:
+            return manifest
+        print(f"Ignoring checkpoint manifest version {manifest['version']}")
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError) as e:
+        print(f"Ignoring unreadable checkpoint manifest: {e}")
+
+    # rebuild from the files on disk, without scores
+    checkpoints = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("checkpoint_") and name.endswith(".npz"):
+                checkpoints.append({"step": int(name[len("checkpoint_"):-len(".npz")]), "file": name, "score": None})
+    return {"version": CHECKPOINT_MANIFEST_VERSION, "checkpoints": checkpoints}
+
+def _write_manifest(directory, manifest):
+    manifest_file = os.path.join(directory, MANIFEST_FILE)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def _load_checkpoint(directory, checkpoint):
+    # -> weights, None if the file is missing or unreadable
+    try:
+        return load_weights_file(os.path.join(directory, checkpoint["file"]))
+    except Exception as e:
+        print(f"Skipping checkpoint {checkpoint['file']}: {e}")
+        return None
+
+def load_latest_checkpoint(directory=CHECKPOINT_DIR):
+    # -> (step, weights) of the newest checkpoint that loads, None if there is none
+    for checkpoint in reversed(read_manifest(directory)["checkpoints"]):
+        weights = _load_checkpoint(directory, checkpoint)
+        if weights is not None:
+            return checkpoint["step"], weights
+    return None
+
+## ==================================================================
+## Checkpoint Writer
+## ==================================================================
+
+class CheckpointWriter:
+    # Writes weight snapshots on a background thread so training never
+    # waits on the disk. Keeps the last `keep_last` checkpoints plus the
+    # `keep_best` highest scores, older files are deleted. When the disk
+    # falls behind, a pending snapshot is replaced by the newer one.
+
+    def __init__(self, directory=CHECKPOINT_DIR, keep_last=CHECKPOINT_KEEP_LAST, keep_best=CHECKPOINT_KEEP_BEST):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        os.makedirs(directory, exist_ok=True)
+
+        # resume from the checkpoint load_latest_checkpoint picks, the unreadable
+        # newer ones are dropped so they neither set the step nor count as kept
+        self.manifest = read_manifest(directory)
+        checkpoints = self.manifest["checkpoints"]
+        while checkpoints and _load_checkpoint(directory, checkpoints[-1]) is None:
+            checkpoints.pop()
+        self.last_step = checkpoints[-1]["step"] if checkpoints else 0
+        self.skipped = 0
+
+        self.pending = queue.Queue(maxsize=CHECKPOINT_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def save(self, step, weights, score=None):
+        # weights must be a snapshot (model.get_weights() returns copies)
+        self.last_step = step
+        item = (step, weights, score)
+        while True:
+            try:
+                self.pending.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.pending.get_nowait()
+                    self.skipped += 1
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        # writes what is still pending
+        self.pending.put(None)
+        self.thread.join()
+
+    def _write_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            step, weights, score = item
+            try:
+                self._write(step, weights, score)
+            except Exception as e:
+                print(f"Checkpoint {step} failed: {e}")
+
+    def _write(self, step, weights, score):
+        start = time.perf_counter()
+        name = _checkpoint_file(step)
+        save_weights_file(weights, os.path.join(self.directory, name))
+
+        checkpoints = [c for c in self.manifest["checkpoints"] if c["step"] != step]
+        checkpoints.append({"step": step, "file": name, "score": score, "time": time.time()})
+        checkpoints.sort(key=lambda c: c["step"])
+
+        # keep the newest and the best scored
+        keep = {c["step"] for c in checkpoints[-self.keep_last:]}
+        scored = [c for c in checkpoints if c["score"] is not None]
+        keep |= {c["step"] for c in sorted(scored, key=lambda c: c["score"], reverse=True)[:self.keep_best]}
+
+        self.manifest["checkpoints"] = [c for c in checkpoints if c["step"] in keep]
+        _write_manifest(self.directory, self.manifest)
+
+        # delete files only once the manifest no longer lists them
+        for c in checkpoints:
+            if c["step"] not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, c["file"]))
+                except FileNotFoundError:
+                    pass
+
+        print(f"Checkpoint {step} written in {(time.perf_counter() - start) * 1000:.0f} ms")
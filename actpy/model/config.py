@@ -11,11 +11,62 @@ FRAME_WIDTH = 512
 FRAME_HEIGHT = 288
 CAPTURE_TARGET_FPS = 24
 
+# Decoded frames are written into a pool of reusable buffers
+FRAME_DECODER_POOL_SIZE = 8
+
+# UDP ingest, packets are reordered per client by frame number
+INGEST_RECV_BUFFER_SIZE = 8 * 1024 * 1024 # socket receive buffer in bytes
+INGEST_BATCH_SIZE = 64 # max packets drained per wake up
+INGEST_QUEUE_SIZE = 64 # packets waiting for decode
+INGEST_STATS_INTERVAL = 10 # seconds
+JITTER_BUFFER_DEPTH = 3 # frames held while waiting for a missing one
+JITTER_BUFFER_MAX_DELAY = 0.02 # seconds to wait for a missing frame
+JITTER_BUFFER_RESET_GAP = 1000 # frames far behind mean the client restarted
+INGEST_CLIENT_TIMEOUT = 10 # seconds without packets before the state of a client is dropped
+REASSEMBLY_SLOTS = 8 # fragmented frames reassembled at once, each slot holds MAX_FRAME_PACKET_SIZE bytes
+REASSEMBLY_TIMEOUT = 0.05 # seconds a fragmented frame may wait for its missing fragments
+
+# Raw packet log (server --record), replayed with replay_packets.py
+PACKET_LOG_DIR = "packet_log"
+PACKET_LOG_FLUSH_INTERVAL = 1 # seconds between index and header flushes
+
+# Frame to action latency tracing
+LATENCY_TRACE_WINDOW = 2048 # last traced actions kept for the percentiles
+LATENCY_REPORT_INTERVAL = 30 # seconds
+
+# Game actor resends an unchanged action state only as a keepalive
+ACTION_KEEPALIVE_INTERVAL = 0.5 # seconds
+ACTION_KEEPALIVE_TIMEOUT = 10 # seconds without new actions before a client gets no keepalives
+
+# Pipeline telemetry, served as Prometheus text on localhost
+TELEMETRY_HOST = "127.0.0.1"
+TELEMETRY_PORT = 9100 # server.py --telemetry-port, 0 disables the endpoint
+TELEMETRY_FLUSH_INTERVAL = 1 # seconds between snapshots of each stage
+TELEMETRY_SUMMARY_INTERVAL = 10 # seconds between console summaries
+
+# Shared memory ring of decoded frames between the frame reader and its consumers
+FRAME_RING_CAPACITY = 32
+FRAME_RING_POLL_INTERVAL = 0.001 # seconds
+FRAME_MAX_LAG = 4 # frames per client a consumer may fall behind before skipping to newer ones
+
+# Bounded channels between stages, see model/channel.py for the overflow policies
+INPUT_KEYS_QUEUE_SIZE = 64 # block
+ACTION_QUEUE_SIZE = 16 # coalesce per client
+DISPLAY_QUEUE_SIZE = 2 # latest wins
+EXPERIENCE_QUEUE_SIZE = 64 # block, each experience holds two frame stacks
+EXPERIENCE_SENDER_SIZE = 64 # experiences the collector holds off its action path while the channel blocks
+TELEMETRY_QUEUE_SIZE = 256 # latest wins
+CHANNEL_BLOCK_TIMEOUT = 1 # seconds between stop checks of a blocked producer
+
 # Packet Constants
 MAX_PORTALS = 8
 MAX_PRESSED_KEYS = 16 
 FRAME_PACKET_HEADER_SIZE = 120
-MAX_PACKET_SIZE = 65000 + FRAME_PACKET_HEADER_SIZE
+MAX_PACKET_SIZE = 65000 + FRAME_PACKET_HEADER_SIZE # largest datagram
+MAX_FRAME_DATA_SIZE = 1 << 20 # compressed frame bytes, frames larger than a datagram are fragmented
+MAX_FRAME_PACKET_SIZE = FRAME_PACKET_HEADER_SIZE + MAX_FRAME_DATA_SIZE
+FRAGMENT_HEADER_SIZE = 24
+FRAGMENT_DATA_SIZE = 16384 # frame packet bytes per fragment
 NO_KEY_VALUE = 0
 
 
@@ -24,10 +75,17 @@ NO_KEY_VALUE = 0
 ## ==================================================================
 
 MODEL_WEIGHTS_FILE = "model_weights.h5"
+INFERENCE_WEIGHTS_FILE = "model_weights.npz" # same weights for the NumPy inference model
 BATCH_SIZE = 32
 UPDATE_TARGET_MODEL_EVERY = 20
 SAVE_WEIGHTS_EVERY = 100
 
+# Checkpoints, written in the background, models resume from the latest one
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_KEEP_LAST = 5
+CHECKPOINT_KEEP_BEST = 3 # by score, the negated mean loss since the previous checkpoint
+CHECKPOINT_QUEUE_SIZE = 2 # snapshots waiting for the disk, older ones are skipped
+
 FRAMES_PER_STEP = 4
 
 ## ==================================================================
@@ -40,7 +98,31 @@ EPSILON_MIN = 0.01
 EPSILON_DECAY = 0.9985
 LEARNING_RATE = 0.002
 
-MEMORY_SIZE = 1000
+# Collector drops a client session after this many seconds without frames
+COLLECTOR_SESSION_TIMEOUT = 10
+
+# Replay memory stores each frame once, 4-bit packed (~74 KB per frame),
+# so a transition costs FRAMES_PER_STEP frames instead of two full stacks
+# (consecutive experiences of a client share a stack, clients may interleave).
+# The first transition of each client also stores its state stack.
+MEMORY_SIZE = 4000
+STACK_DEDUP_CLIENTS = 16 # clients whose last stack is remembered for the sharing
+REPLAY_FRAME_CAPACITY = (MEMORY_SIZE + STACK_DEDUP_CLIENTS) * FRAMES_PER_STEP
+
+# Prioritized replay, experiences are sampled proportionally to |TD error|^alpha
+PRIORITIZED_REPLAY = True
+PRIORITY_ALPHA = 0.6 # 0 is uniform sampling
+PRIORITY_BETA = 0.4 # importance-sampling correction, annealed to 1
+PRIORITY_BETA_STEPS = 100000 # minibatches until beta reaches 1
+PRIORITY_EPSILON = 1e-3 # keeps zero error experiences sampleable
+
+# Recorded experiences (columnar, memory-mapped)
+EXPERIENCE_STORE_DIR = "experiences"
+
+# Offline training from recorded experiences
+OFFLINE_EPOCHS = 1
+OFFLINE_STEPS_PER_EXPERIENCE = 1 # minibatches trained for each experience read
+OFFLINE_PREFETCH_BATCHES = 8
 
 ## ==================================================================
 ## Action space
@@ -1,3 +1,4 @@
+import queue
 import pygame
 import numpy as np
 
@@ -5,6 +6,7 @@ from model.config import FRAME_WIDTH, FRAME_HEIGHT, DISPLAY_SCALE, \
     BAR_HEIGHT, BAR_TEXT_WIDTH, ACTIONS_TEXT_SIZE, \
     HP_COLOR, MP_COLOR, EXP_COLOR, ACTION_COLOR, ACTION_PICKED_COLOR, \
     FRAMES_PER_STEP, Actions, ACTION_NAMES
+from model.telemetry import Telemetry
 
 ## ==================================================================
 ## Display Logic with Pygame
@@ -36,96 +38,121 @@ def post_quit_event():
 def close_display():
     pygame.quit()
 
-def update_display(screen, frames, hp, mp, exp, action_states, action_vector, action_index):
-
-    # clear the screen
-    screen.fill((0, 0, 0))
-
-    # draw the last four frames
-    for i, f in enumerate(frames):
-        # Set position and scale depending on the frame index
-        if i == len(frames) - 1:  # last frame (most recent)
-            h = FRAME_HEIGHT * DISPLAY_SCALE
-            w = FRAME_WIDTH * DISPLAY_SCALE
-            x = 0
-            y = 0
-        else:
-            h = FRAME_HEIGHT * DISPLAY_SCALE / 4
-            w = FRAME_WIDTH * DISPLAY_SCALE / 4 - 1
-            x = (FRAMES_PER_STEP-i-2) * (w + 1) 
-            y = FRAME_HEIGHT * DISPLAY_SCALE + 1 
-
-        _draw_grayscale_frame(screen, f, x, y, w, h)
-
-    # draw metrics
-    bar_offset = FRAME_HEIGHT * DISPLAY_SCALE * (1+1/4) + 1
-    bar_width = FRAME_WIDTH * DISPLAY_SCALE - BAR_TEXT_WIDTH - 1
-
-    _draw_h_bar(screen, 0, bar_offset + 0 * BAR_HEIGHT + 1, bar_width, BAR_HEIGHT - 2, hp, HP_COLOR)
-    _draw_h_bar(screen, 0, bar_offset + 1 * BAR_HEIGHT + 1, bar_width, BAR_HEIGHT - 2, mp, MP_COLOR)
-    _draw_h_bar(screen, 0, bar_offset + 2 * BAR_HEIGHT + 1, bar_width, BAR_HEIGHT - 2, exp, EXP_COLOR)
-
-    _draw_text(screen, "HP: {:.2f}%".format(hp*100), bar_width + 3, bar_offset + 0 * BAR_HEIGHT, BAR_HEIGHT - 2, HP_COLOR)
-    _draw_text(screen, "MP: {:.2f}%".format(mp*100), bar_width + 3, bar_offset + 1 * BAR_HEIGHT, BAR_HEIGHT - 2, MP_COLOR)
-    _draw_text(screen, "EXP: {:.2f}%".format(exp*100), bar_width + 3, bar_offset + 2 * BAR_HEIGHT, BAR_HEIGHT - 2, EXP_COLOR)
-
-    # draw actions
-    actions_text_size = ACTIONS_TEXT_SIZE
-    actions_y_offset = FRAME_HEIGHT * DISPLAY_SCALE + 1
-    actions_x_offset = FRAME_WIDTH * DISPLAY_SCALE - BAR_TEXT_WIDTH
-    actions_height = FRAME_HEIGHT * DISPLAY_SCALE / 4 - 1
+## ==================================================================
+## Renderer
+## ==================================================================
+
+class DisplayRenderer:
+    # Keeps fonts, text, layout and frame surfaces between updates.
+    # Frames go through a persistent 8-bit surface with a grayscale palette.
+    # Only the newest frame is sent, its thumbnail is cached by frame number
+    # and shown for the older frames of the stack (frames skipped by the
+    # display have no thumbnail and leave their place empty).
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.fonts = {}
+        self.texts = {}
+
+        # Static layout
+        self.main_size = (FRAME_WIDTH * DISPLAY_SCALE, FRAME_HEIGHT * DISPLAY_SCALE)
+        self.thumbnail_size = (int(FRAME_WIDTH * DISPLAY_SCALE / 4 - 1), int(FRAME_HEIGHT * DISPLAY_SCALE / 4))
+        self.thumbnail_positions = [
+            ((FRAMES_PER_STEP - i - 2) * (self.thumbnail_size[0] + 1), FRAME_HEIGHT * DISPLAY_SCALE + 1)
+            for i in range(FRAMES_PER_STEP - 1)
+        ]
+        self.bar_offset = FRAME_HEIGHT * DISPLAY_SCALE * (1 + 1/4) + 1
+        self.bar_width = FRAME_WIDTH * DISPLAY_SCALE - BAR_TEXT_WIDTH - 1
+        actions_height = FRAME_HEIGHT * DISPLAY_SCALE / 4 - 1
+        self.action_width = BAR_TEXT_WIDTH / Actions._SIZE - 2
+        self.action_height = actions_height - ACTIONS_TEXT_SIZE - 4
+        self.action_positions = [
+            (FRAME_WIDTH * DISPLAY_SCALE - BAR_TEXT_WIDTH + i * (self.action_width + 2) + 1, FRAME_HEIGHT * DISPLAY_SCALE + 2)
+            for i in range(Actions._SIZE)
+        ]
+
+        # Frame surfaces
+        self.gray_surface = _make_grayscale_surface((FRAME_WIDTH, FRAME_HEIGHT))
+        self.main_surface = _make_grayscale_surface(self.main_size)
+        self.thumbnails = {} # frame number -> scaled surface
+        self.free_thumbnails = [_make_grayscale_surface(self.thumbnail_size) for _ in range(FRAMES_PER_STEP)]
+
+    def update(self, frame_numbers, frame, hp, mp, exp, action_states, action_vector, action_index):
+
+        # clear the screen
+        self.screen.fill((0, 0, 0))
+
+        # draw the newest frame, then the older ones of the stack from their thumbnails
+        self._recycle_thumbnails(frame_numbers)
+        self._scale_frame(frame, self.main_surface)
+        self.screen.blit(self.main_surface, (0, 0))
+        if frame_numbers[-1] not in self.thumbnails:
+            self.thumbnails[frame_numbers[-1]] = pygame.transform.scale(
+                self.main_surface, self.thumbnail_size, self.free_thumbnails.pop())
+        for i, frame_number in enumerate(frame_numbers[:-1]):
+            if frame_number in self.thumbnails:
+                self.screen.blit(self.thumbnails[frame_number], self.thumbnail_positions[i])
+
+        # draw metrics
+        for row, (label, value, color) in enumerate([("HP", hp, HP_COLOR), ("MP", mp, MP_COLOR), ("EXP", exp, EXP_COLOR)]):
+            y = self.bar_offset + row * BAR_HEIGHT
+            _draw_h_bar(self.screen, 0, y + 1, self.bar_width, BAR_HEIGHT - 2, value, color)
+            text_surface = self._font(BAR_HEIGHT - 2).render("{}: {:.2f}%".format(label, value*100), True, color)
+            self.screen.blit(text_surface, (self.bar_width + 3, y))
+
+        # draw actions
+        probabilities = _action_probabilities(action_vector)
+        for i, (action_x, action_y) in enumerate(self.action_positions):
+            color = ACTION_PICKED_COLOR if action_index == i else ACTION_COLOR
+            _draw_v_bar(self.screen, action_x, action_y, self.action_width, self.action_height, probabilities[i], color)
+
+            text_color = (255, 255, 255) if action_states[i] != 0 else (100, 100, 100)
+            self.screen.blit(self._text(ACTION_NAMES[i], ACTIONS_TEXT_SIZE, text_color), (action_x, action_y + self.action_height + 1))
+
+        _display_flip()
+
+    def _scale_frame(self, frame, surface):
+        pygame.surfarray.blit_array(self.gray_surface, frame.swapaxes(0, 1))
+        pygame.transform.scale(self.gray_surface, surface.get_size(), surface)
+        return surface
+
+    def _recycle_thumbnails(self, frame_numbers):
+        for frame_number in list(self.thumbnails):
+            if frame_number not in frame_numbers:
+                self.free_thumbnails.append(self.thumbnails.pop(frame_number))
+
+    def _font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.SysFont("Arial", size)
+        return self.fonts[size]
+
+    def _text(self, text, size, color):
+        # static labels are rendered once
+        key = (text, size, color)
+        if key not in self.texts:
+            self.texts[key] = self._font(size).render(text, True, color)
+        return self.texts[key]
+
+## ==================================================================
+
+def _make_grayscale_surface(size):
+    surface = pygame.Surface(size, depth=8)
+    surface.set_palette([(i, i, i) for i in range(256)])
+    return surface
 
+def _action_probabilities(action_vector):
     # min-max normalize the action vector
     min_val, max_val = np.min(action_vector), np.max(action_vector)
     if min_val != 0 and max_val != 0:  # Avoid divide by zero
         probabilities = (action_vector - min_val) / (max_val - min_val)
     else:
-        probabilities = action_vector
+        probabilities = np.array(action_vector, dtype=np.float32)
     # make sure the sum of the probabilities is 1
     prob_sum = np.sum(probabilities)
     if prob_sum > 0:
         probabilities /= prob_sum
     # make from 0.1 to 1
-    probabilities = probabilities * 0.9 + 0.1
-
-    for i in range(Actions._SIZE):
-        action_width = BAR_TEXT_WIDTH / Actions._SIZE - 2
-        action_height = actions_height - actions_text_size - 4
-        action_x = actions_x_offset + i * (action_width + 2) + 1
-        action_y = actions_y_offset + 1
-
-        color = ACTION_COLOR 
-        if action_index == i:
-            color = ACTION_PICKED_COLOR
-
-        _draw_v_bar(screen, action_x, action_y, action_width, action_height, probabilities[i], color)
-
-        text_color = (255, 255, 255)
-        if action_states[i] == 0:
-            text_color = (100, 100, 100)
-
-        _draw_text(screen, ACTION_NAMES[i], action_x, action_y + action_height + 1, actions_text_size, text_color)
-
-    _display_flip()
-
-## ==================================================================
-
-def _draw_grayscale_frame(screen, frame, x, y, w, h):
-    if frame is None:
-        return
-    # convert grayscale to rgb
-    frame = np.stack([frame.swapaxes(0, 1)] * 3, -1)
-    # convert frame to a surface from np array
-    frame_surface = pygame.surfarray.make_surface(frame)
-    # scale the frame to the display size
-    frame_surface = pygame.transform.scale(frame_surface, (w, h))
-    # draw the frame at the specified position
-    screen.blit(frame_surface, (x, y))
-
-def _draw_text(screen, text, x, y, size, color=(255, 255, 255)):
-    font = pygame.font.SysFont("Arial", size)
-    text_surface = font.render(text, True, color)
-    screen.blit(text_surface, (x, y))
+    return probabilities * 0.9 + 0.1
 
 def _draw_h_bar(screen, x, y, w, h, percentage, color):
     bar_width = int(w * percentage)
@@ -143,19 +170,31 @@ def _display_flip():
 ## Display Entry
 ## ==================================================================
 
-def display_entry(stop_event, display_queue):
+def display_entry(stop_event, display_queue, telemetry_queue=None):
     screen = initialize_display()
+    renderer = DisplayRenderer(screen)
+    telemetry = Telemetry("display", telemetry_queue)
 
     while not stop_event.is_set():
+        telemetry.maybe_flush()
         try:
-            # get the next frame to display
-            frames, (hp, mp, exp, mapDim, player, portals), action_states, action_vector, action_index = display_queue.get(timeout=0.1)
+            # get the next frame to display, skipping to the newest queued one
+            message = display_queue.get(timeout=0.1)
+            while True:
+                try:
+                    message = display_queue.get_nowait()
+                    telemetry.count('skipped')
+                except queue.Empty:
+                    break
+
             # update the display
-            update_display(screen, frames, hp, mp, exp, action_states, action_vector, action_index)
+            frame_numbers, frame, (hp, mp, exp, mapDim, player, portals), action_states, action_vector, action_index = message
+            renderer.update(frame_numbers, frame, hp, mp, exp, action_states, action_vector, action_index)
+            telemetry.count('frames')
 
             # check for quit event
             display_event_handle()
         except:
             continue
             
-    close_display()
\ No newline at end of file
+    close_display()
@@ -0,0 +1,193 @@
+import os
+import json
+import numpy as np
+
+from model.config import FRAME_WIDTH, FRAME_HEIGHT, FRAMES_PER_STEP, Actions, EXPERIENCE_STORE_DIR, \
+    STACK_DEDUP_CLIENTS
+from model.frame_decoder import PACKED_FRAME_SIZE, pack_8bit_to_4bit, unpack_frame_stacks
+
+## ==================================================================
+## On-disk Layout
+## ==================================================================
+
+# A store is a directory with a json header and one fixed-stride file
+# per column. Frames are kept once, 4-bit packed, and transitions refer
+# to them by frame index.
+EXPERIENCE_STORE_VERSION = 1
+HEADER_FILE = "header.json"
+
+FRAME_COLUMNS = {
+    "frames": ((PACKED_FRAME_SIZE,), np.uint8),
+}
+TRANSITION_COLUMNS = {
+    "state_ids": ((FRAMES_PER_STEP,), np.int64),
+    "action_states": ((Actions._SIZE,), np.uint8),
+    "actions": ((), np.int32),
+    "rewards": ((), np.float32),
+    "next_state_ids": ((FRAMES_PER_STEP,), np.int64),
+    "next_action_states": ((Actions._SIZE,), np.uint8),
+    "dones": ((), np.uint8),
+    "metrics": ((3,), np.float32), # hp, mp, exp of the next state
+}
+
+def _column_file(path, name):
+    return os.path.join(path, name + ".bin")
+
+def _stride(shape, dtype):
+    return int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+
+def _make_header():
+    return {
+        "version": EXPERIENCE_STORE_VERSION,
+        "frame_width": FRAME_WIDTH,
+        "frame_height": FRAME_HEIGHT,
+        "frames_per_step": FRAMES_PER_STEP,
+        "frame_encoding": "4bit",
+        "columns": {
+            name: {"shape": list(shape), "dtype": np.dtype(dtype).str}
+            for name, (shape, dtype) in {**FRAME_COLUMNS, **TRANSITION_COLUMNS}.items()
+        },
+        "frame_count": 0,
+        "count": 0,
+    }
+
+## ==================================================================
+## Writer
+## ==================================================================
+
+class ExperienceWriter:
+
+    def __init__(self, path=EXPERIENCE_STORE_DIR, flush_every=100):
+        self.path = path
+        self.flush_every = flush_every
+        os.makedirs(path, exist_ok=True)
+
+        self.header = _make_header()
+        self.files = {
+            name: open(_column_file(path, name), "wb")
+            for name in {**FRAME_COLUMNS, **TRANSITION_COLUMNS}
+        }
+        self.packed = np.zeros(PACKED_FRAME_SIZE, dtype=np.uint8)
+        self._last_stacks = {} # client key -> (stack, frame ids), least recently used first
+        self._write_header()
+
+    def append(self, state, action_states, action, reward, next_state, next_action_states, done, metrics, key=None):
+        # key: client of the experience (its addr), stacks are only shared within a client
+        state_ids = self._write_stack(state, key)
+        next_state_ids = self._write_stack(next_state, key)
+
+        record = {
+            "state_ids": state_ids,
+            "action_states": np.reshape(action_states, -1),
+            "actions": action,
+            "rewards": reward,
+            "next_state_ids": next_state_ids,
+            "next_action_states": np.reshape(next_action_states, -1),
+            "dones": done,
+            "metrics": metrics,
+        }
+        for name, (shape, dtype) in TRANSITION_COLUMNS.items():
+            self.files[name].write(np.asarray(record[name], dtype=dtype).tobytes())
+
+        self.header["count"] += 1
+        if self.header["count"] % self.flush_every == 0:
+            self.flush()
+
+    def _write_stack(self, stack, key):
+        # consecutive experiences of a client share stacks, only write new ones
+        last = self._last_stacks.pop(key, None)
+        if last is not None and np.array_equal(stack, last[0]):
+            self._last_stacks[key] = last
+            return last[1]
+
+        first = self.header["frame_count"]
+        ids = np.arange(first, first + FRAMES_PER_STEP, dtype=np.int64)
+        for c in range(FRAMES_PER_STEP):
+            pack_8bit_to_4bit(stack[0, :, :, c], self.packed)
+            self.files["frames"].write(self.packed.tobytes())
+        self.header["frame_count"] += FRAMES_PER_STEP
+
+        self._last_stacks[key] = (stack, ids)
+        if len(self._last_stacks) > STACK_DEDUP_CLIENTS:
+            del self._last_stacks[next(iter(self._last_stacks))]
+        return ids
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+        self._write_header()
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+    def _write_header(self):
+        # replace the header in one step so readers never see a partial file
+        header_file = os.path.join(self.path, HEADER_FILE)
+        with open(header_file + ".tmp", "w") as f:
+            json.dump(self.header, f, indent=2)
+        os.replace(header_file + ".tmp", header_file)
+
+## ==================================================================
+## Memory-mapped Reader
+## ==================================================================
+
+class ExperienceReader:
+
+    def __init__(self, path=EXPERIENCE_STORE_DIR):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        if self.header["version"] != EXPERIENCE_STORE_VERSION:
+            raise Exception(f"Unsupported experience store version: {self.header['version']}")
+        if (self.header["frame_width"], self.header["frame_height"], self.header["frames_per_step"]) \
+                != (FRAME_WIDTH, FRAME_HEIGHT, FRAMES_PER_STEP):
+            raise Exception("Experience store was recorded with a different frame configuration")
+
+        self.rng = np.random.default_rng()
+        self.columns = {}
+        for name, (shape, dtype) in {**FRAME_COLUMNS, **TRANSITION_COLUMNS}.items():
+            self.columns[name] = self._map_column(name, shape, dtype)
+
+        # a store that was not closed cleanly can have more rows than its header,
+        # only trust rows that are complete in every column
+        self.count = min(len(self.columns[name]) for name in TRANSITION_COLUMNS)
+        self.frame_count = len(self.columns["frames"])
+        next_state_ids = self.columns["next_state_ids"]
+        while self.count > 0 and next_state_ids[self.count - 1].max() >= self.frame_count:
+            self.count -= 1
+
+    def _map_column(self, name, shape, dtype):
+        filename = _column_file(self.path, name)
+        rows = os.path.getsize(filename) // _stride(shape, dtype)
+        if rows == 0:
+            return np.zeros((0, *shape), dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode="r", shape=(rows, *shape))
+
+    def __len__(self):
+        return self.count
+
+    def sample(self, batch_size):
+        # -> (experience ids, (states, action_states, actions, rewards, next_states, next_action_states, dones))
+        indices = np.sort(self.rng.choice(self.count, batch_size, replace=False))
+        return self.gather(indices)
+
+    def gather(self, indices):
+        c = self.columns
+        batch = (
+            unpack_frame_stacks(c["frames"], c["state_ids"][indices]),
+            np.asarray(c["action_states"][indices]),
+            np.asarray(c["actions"][indices], dtype=np.int64),
+            np.asarray(c["rewards"][indices]),
+            unpack_frame_stacks(c["frames"], c["next_state_ids"][indices]),
+            np.asarray(c["next_action_states"][indices]),
+            np.asarray(c["dones"][indices], dtype=np.float32),
+        )
+        return indices, batch
+
+    def read(self, index):
+        # single experience in the layout the collector emits, without the client addr
+        (states, action_states, actions, rewards, next_states, next_action_states, dones) = self.gather(np.array([index]))[1]
+        return (states, action_states, int(actions[0]), float(rewards[0]), next_states, next_action_states, bool(dones[0]),
+                tuple(float(v) for v in self.columns["metrics"][index]))
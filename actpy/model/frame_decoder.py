@@ -0,0 +1,109 @@
+import zlib
+import numpy as np
+
+from model.config import FRAME_WIDTH, FRAME_HEIGHT, FRAME_DECODER_POOL_SIZE
+from model.protocol import FRAME_VERSION_STANDALONE, FRAME_VERSION_DELTA, FrameFlags
+
+## ==================================================================
+## 4-bit -> 8-bit Lookup Table
+## ==================================================================
+
+# Each packed byte holds two 4-bit pixels (high nibble first), every
+# possible byte value maps to its pair of 8-bit pixels
+UNPACK_4BIT_LUT = np.empty((256, 2), dtype=np.uint8)
+UNPACK_4BIT_LUT[:, 0] = np.arange(256) & 0xF0
+UNPACK_4BIT_LUT[:, 1] = (np.arange(256) & 0x0F) << 4
+
+PACKED_FRAME_SIZE = FRAME_WIDTH * FRAME_HEIGHT // 2
+
+def unpack_4bit_to_8bit(packed, out):
+    # packed: (N,) uint8, out: any uint8 array holding 2*N pixels
+    np.take(UNPACK_4BIT_LUT, packed, axis=0, out=out.reshape(-1, 2))
+    return out
+
+def unpack_frame_stacks(frames, frame_ids):
+    # frames: (N, PACKED_FRAME_SIZE) packed frames, frame_ids: (batch, stack) rows of frames
+    # -> (batch, FRAME_HEIGHT, FRAME_WIDTH, stack) model input
+    batch_size, stack_size = frame_ids.shape
+    states = np.empty((batch_size, FRAME_HEIGHT, FRAME_WIDTH, stack_size), dtype=np.uint8)
+    for c in range(stack_size):
+        packed = frames[frame_ids[:, c]]
+        states[..., c] = np.take(UNPACK_4BIT_LUT, packed, axis=0).reshape(batch_size, FRAME_HEIGHT, FRAME_WIDTH)
+    return states
+
+def pack_8bit_to_4bit(frame, out):
+    # inverse of unpack_4bit_to_8bit, keeps the high nibble of each pixel
+    pairs = frame.reshape(-1, 2)
+    np.bitwise_and(pairs[:, 0], 0xF0, out=out)
+    out |= pairs[:, 1] >> 4
+    return out
+
+## ==================================================================
+## Frame Decoder
+## ==================================================================
+
+class FrameDecoder:
+    # Decodes compressed 4-bit frames into a small pool of reusable
+    # (FRAME_HEIGHT, FRAME_WIDTH) buffers, a returned frame stays valid
+    # until the pool wraps around.
+    # Delta frames are applied in place on the last packed frame of their
+    # client. After a lost frame, deltas are dropped until the next keyframe.
+
+    def __init__(self, pool_size=FRAME_DECODER_POOL_SIZE):
+        self.pool = np.zeros((pool_size, FRAME_HEIGHT, FRAME_WIDTH), dtype=np.uint8)
+        self.index = 0
+        self.references = {} # addr -> [frame number or None when invalid, packed frame]
+        self.stats = {'keyframes': 0, 'deltas': 0, 'deltas_dropped': 0}
+
+    def next_buffer(self):
+        frame = self.pool[self.index]
+        self.index = (self.index + 1) % len(self.pool)
+        return frame
+
+    def _decompress(self, compressed):
+        packed = np.frombuffer(zlib.decompress(compressed), dtype=np.uint8)
+        if len(packed) != PACKED_FRAME_SIZE:
+            raise Exception(f"Unexpected frame size: {len(packed)} bytes")
+        return packed
+
+    def decode(self, compressed, out=None):
+        # standalone frame
+        packed = self._decompress(compressed)
+        if out is None:
+            out = self.next_buffer()
+        return unpack_4bit_to_8bit(packed, out)
+
+    def decode_packet(self, addr, frame_number, version, flags, compressed):
+        # -> decoded frame, None while the client waits for a keyframe
+        if version == FRAME_VERSION_STANDALONE:
+            return self.decode(compressed)
+        if version != FRAME_VERSION_DELTA:
+            raise Exception(f"Unknown frame version {version}")
+
+        if addr not in self.references:
+            self.references[addr] = [None, np.zeros(PACKED_FRAME_SIZE, dtype=np.uint8)]
+        reference = self.references[addr]
+        reference_number, packed = reference
+        reference[0] = None # until this frame decoded
+
+        if flags & FrameFlags.KEYFRAME:
+            packed[:] = self._decompress(compressed)
+            self.stats['keyframes'] += 1
+        elif flags & FrameFlags.DELTA:
+            if reference_number != frame_number - 1:
+                self.stats['deltas_dropped'] += 1
+                return None
+            np.bitwise_xor(packed, self._decompress(compressed), out=packed)
+            self.stats['deltas'] += 1
+        else:
+            raise Exception(f"Frame {frame_number} is neither a keyframe nor a delta")
+
+        reference[0] = frame_number
+        return unpack_4bit_to_8bit(packed, self.next_buffer())
+
+    def forget(self, addr):
+        # client gone, drop its reference frame
+        self.references.pop(addr, None)
+
+    def format_stats(self):
+        return ", ".join(f"{name}: {value}" for name, value in self.stats.items())
@@ -0,0 +1,165 @@
+import time
+import queue
+import socket
+import numpy as np
+
+from model.config import FRAME_WIDTH, FRAME_HEIGHT, MAX_PORTALS, Actions, \
+    FRAME_RING_CAPACITY, FRAME_RING_POLL_INTERVAL
+from model.latency_trace import TraceStage
+from model.shared_buffer import create_shared_memory, attach_shared_memory, layout_arrays, map_arrays
+
+## ==================================================================
+## Slot Layout
+## ==================================================================
+
+FRAME_METADATA_DTYPE = np.dtype([
+    ('ip', np.uint8, 4),
+    ('port', np.uint16),
+    ('frame_number', np.uint64),
+    ('metrics', np.float32, 3), # hp, mp, exp
+    ('map_dim', np.uint16, 2),
+    ('player', np.uint16, 2),
+    ('portal_count', np.uint8),
+    ('portals', np.uint16, (MAX_PORTALS, 2)),
+    ('action_state', np.uint8, Actions._SIZE),
+    ('trace', np.float64, TraceStage._SIZE),
+])
+
+def _ring_specs(capacity):
+    return [
+        ('head', (1,), np.uint64),            # sequence number of the last written frame
+        ('slot_seq', (capacity,), np.uint64), # sequence number held by each slot, 0 while writing
+        ('metadata', (capacity,), FRAME_METADATA_DTYPE),
+        ('frames', (capacity, FRAME_HEIGHT, FRAME_WIDTH), np.uint8),
+    ]
+
+## ==================================================================
+## Frame Ring Buffer
+## ==================================================================
+
+class FrameRing:
+    # Single-writer, multi-reader ring of decoded frames in shared memory.
+    # Readers get a view of the slot and copy it once into their own buffer
+    # with read_frame, which checks the sequence again after the copy, so a
+    # frame the writer overwrote meanwhile is dropped, never used.
+    # Readers that fall behind skip to the oldest frame still in the ring.
+
+    def __init__(self, capacity=FRAME_RING_CAPACITY, name=None):
+        self.capacity = capacity
+        specs = _ring_specs(capacity)
+        offsets, size = layout_arrays(specs)
+        if name is None:
+            self.shm = create_shared_memory(size)
+            self.owner = True
+        else:
+            self.shm = attach_shared_memory(name)
+            self.owner = False
+        arrays = map_arrays(self.shm.buf, specs, offsets)
+        self.head = arrays['head']
+        self.slot_seq = arrays['slot_seq']
+        self.metadata = arrays['metadata']
+        self.frames = arrays['frames']
+        if self.owner:
+            self.head[0] = 0
+            self.slot_seq[:] = 0
+
+        # Reader state, local to each process
+        self.read_seq = 0
+        self.dropped = 0
+
+    # Processes receive an attached reader instead of a copy
+    def __getstate__(self):
+        return (self.shm.name, self.capacity)
+
+    def __setstate__(self, state):
+        name, capacity = state
+        self.__init__(capacity, name)
+
+    def close(self):
+        # drop views before closing the mapping
+        self.head = self.slot_seq = self.metadata = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    ## Writer
+    ## ------------------------------------------------------------------
+
+    def put(self, addr, frame_number, frame, metrics, action_state, trace):
+        hp, mp, exp, mapDim, player, portals = metrics
+        seq = int(self.head[0]) + 1
+        slot = seq % self.capacity
+
+        # invalidate the slot while it is being written
+        self.slot_seq[slot] = 0
+
+        meta = self.metadata[slot]
+        meta['ip'] = np.frombuffer(socket.inet_aton(addr[0]), dtype=np.uint8)
+        meta['port'] = addr[1]
+        meta['frame_number'] = frame_number
+        meta['metrics'] = (hp, mp, exp)
+        meta['map_dim'] = mapDim
+        meta['player'] = player
+        meta['portal_count'] = len(portals)
+        if portals:
+            meta['portals'][:len(portals)] = portals
+        meta['action_state'] = action_state
+        meta['trace'] = trace
+        np.copyto(self.frames[slot], frame)
+
+        # publish
+        self.slot_seq[slot] = seq
+        self.head[0] = seq
+
+    ## Reader
+    ## ------------------------------------------------------------------
+
+    def get(self, timeout=None, max_lag=None):
+        # max_lag: skip frames older than the newest max_lag ones, consumers
+        # that must act on recent frames stay close to the writer under load
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = int(self.head[0])
+            if head > self.read_seq:
+                # skip frames that were already overwritten, or too old
+                oldest = head - self.capacity + 1
+                if max_lag is not None:
+                    oldest = max(oldest, head - max_lag + 1)
+                if self.read_seq + 1 < oldest:
+                    self.dropped += oldest - self.read_seq - 1
+                    self.read_seq = oldest - 1
+
+                seq = self.read_seq + 1
+                slot = seq % self.capacity
+                item = self._read_slot(slot)
+                self.read_seq = seq
+
+                # make sure the slot was not overwritten while reading
+                if int(self.slot_seq[slot]) == seq:
+                    return item
+                self.dropped += 1
+                continue
+
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Empty
+            time.sleep(FRAME_RING_POLL_INTERVAL)
+
+    def _read_slot(self, slot):
+        meta = self.metadata[slot]
+        addr = (socket.inet_ntoa(meta['ip'].tobytes()), int(meta['port']))
+        hp, mp, exp = (float(v) for v in meta['metrics'])
+        mapDim = tuple(int(v) for v in meta['map_dim'])
+        player = tuple(int(v) for v in meta['player'])
+        portals = [tuple(int(v) for v in p) for p in meta['portals'][:meta['portal_count']]]
+        action_state = meta['action_state'].copy()
+        trace = meta['trace'].copy()
+        return (addr, int(meta['frame_number']), self.frames[slot], (hp, mp, exp, mapDim, player, portals), action_state, trace)
+
+    def read_frame(self, frame, out):
+        # copies the frame view of the last get into `out`, False (counted as
+        # dropped) when the writer reused the slot meanwhile and the copy is torn
+        np.copyto(out, frame)
+        if int(self.slot_seq[self.read_seq % self.capacity]) == self.read_seq:
+            return True
+        self.dropped += 1
+        return False
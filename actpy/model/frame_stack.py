@@ -0,0 +1,53 @@
+import numpy as np
+
+from model.config import FRAME_WIDTH, FRAME_HEIGHT, FRAMES_PER_STEP
+
+## ==================================================================
+## Frame Stack
+## ==================================================================
+
+class FrameStack:
+    # Last `depth` frames in model layout (1, H, W, depth). Each frame is
+    # written once, at its rotating channel, the ordered state is only built
+    # when a step needs it.
+
+    def __init__(self, depth=FRAMES_PER_STEP):
+        self.depth = depth
+        self.buffer = np.zeros((1, FRAME_HEIGHT, FRAME_WIDTH, depth), dtype=np.uint8)
+        self.numbers = [None] * depth
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.depth)
+
+    def next_frame(self):
+        # (H, W) view of the channel the next push goes to, to copy a frame straight into it
+        return self.buffer[0, :, :, self.count % self.depth]
+
+    def push(self, frame_number, frame=None):
+        # frame None: already copied into next_frame()
+        slot = self.count % self.depth
+        if frame is not None:
+            self.buffer[0, :, :, slot] = frame
+        self.numbers[slot] = frame_number
+        self.count += 1
+
+    def _start(self):
+        # channel of the oldest frame
+        return self.count % self.depth
+
+    def copy(self):
+        # ordered contiguous (1, H, W, depth) state, oldest first
+        start = self._start()
+        if start == 0:
+            return self.buffer.copy()
+        return np.concatenate((self.buffer[..., start:], self.buffer[..., :start]), axis=-1)
+
+    def frame_numbers(self):
+        start = self._start()
+        numbers = self.numbers[start:] + self.numbers[:start]
+        return tuple(numbers[self.depth - len(self):])
+
+    def newest(self):
+        # (H, W) view of the last pushed frame, only valid until the next push
+        return self.buffer[0, :, :, (self.count - 1) % self.depth]
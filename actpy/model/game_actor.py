@@ -1,40 +1,114 @@
-import numpy as np
-import struct
+import time
+import queue
+
+from model.config import ACTION_KEEPALIVE_INTERVAL, ACTION_KEEPALIVE_TIMEOUT, LATENCY_REPORT_INTERVAL
+from model.latency_trace import LatencyTracer, TraceStage, stamp
+from model.protocol import encode_action_mask, action_states_to_mask
+from model.telemetry import Telemetry
 
-from model.config import Actions, ACTION_TO_KEY_MAP, MAX_PRESSED_KEYS
-    
 ## ==================================================================
-## Utility Functions
+## Action Sender
 ## ==================================================================
 
-def _actions_to_keys(action_states):
-    # translate actions to keys
-    keys = []
-    for i, action in enumerate(action_states):
-        if action == 1:
-            keys.append(ACTION_TO_KEY_MAP[i])
-    return keys
+class ActionSender:
+    # Sends the latest action state of each client. A backlog is coalesced
+    # to the newest message per address, a state equal to the last one sent
+    # is skipped and only repeated every keepalive interval. Every action is
+    # traced, coalesced and unchanged ones when the actor is done with them.
+
+    def __init__(self, sock, tracer):
+        self.sock = sock
+        self.tracer = tracer
+        self.clients = {} # addr -> [last mask sent, last send time, last action time]
+        self.stats = {'sent': 0, 'coalesced': 0, 'unchanged': 0, 'keepalives': 0}
+
+    def handle(self, messages):
+        # keep only the newest message of each client
+        latest = {}
+        coalesced = [] # (frame_number, trace) of the older messages
+        for addr, mask, frame_number, trace in messages:
+            if addr in latest:
+                self.stats['coalesced'] += 1
+                coalesced.append(latest[addr][1:])
+            latest[addr] = (mask, frame_number, trace)
+
+        now = time.monotonic()
+        for addr, (mask, frame_number, trace) in latest.items():
+            # older senders hand over the toggle array
+            if not isinstance(mask, int):
+                mask = action_states_to_mask(mask)
+
+            client = self.clients.get(addr)
+            if client is not None:
+                client[2] = now
+            if client is not None and client[0] == mask:
+                self.stats['unchanged'] += 1
+            else:
+                self._send(addr, mask, now)
+            stamp(trace, TraceStage.SEND)
+            self.tracer.record(frame_number, trace)
+
+        for frame_number, trace in coalesced:
+            stamp(trace, TraceStage.SEND)
+            self.tracer.record(frame_number, trace)
+
+    def send_keepalives(self):
+        now = time.monotonic()
+        for addr, (mask, sent_time, action_time) in list(self.clients.items()):
+            if now - action_time > ACTION_KEEPALIVE_TIMEOUT:
+                del self.clients[addr]
+            elif now - sent_time >= ACTION_KEEPALIVE_INTERVAL:
+                self._send(addr, mask, now)
+                self.stats['keepalives'] += 1
+
+    def _send(self, addr, mask, now):
+        # packets are precomputed for every toggle state
+        self.sock.sendto(encode_action_mask(mask), addr)
+        self.stats['sent'] += 1
+        action_time = self.clients[addr][2] if addr in self.clients else now
+        self.clients[addr] = [mask, now, action_time]
+
+    def format_stats(self):
+        return ", ".join(f"{name}: {value}" for name, value in self.stats.items())
 
 ## ==================================================================
 ## Game Actor Entry
 ## ==================================================================
 
-def game_actor_entry(sock, stop_event, action_queue):
-    while not stop_event.is_set():
-        # Check if there is an action to be sent
-        try:
-            addr, action_states = action_queue.get(timeout=1)
-        except:
-            continue
+def game_actor_entry(sock, stop_event, action_queue, telemetry_queue=None):
+    # Frame to action latency, traced on the frame that triggered each action
+    tracer = LatencyTracer()
+    sender = ActionSender(sock, tracer)
+    telemetry = Telemetry("game_actor", telemetry_queue)
+    last_stats_time = time.monotonic()
 
-        # Translate actions to keys
-        keys = _actions_to_keys(action_states)
+    while not stop_event.is_set():
+        tracer.maybe_report()
+        if telemetry.maybe_flush():
+            telemetry.set_counters(sender.stats)
+            telemetry.gauge('action_queue_depth', action_queue.qsize())
+            telemetry.gauge('clients', len(sender.clients))
+        if time.monotonic() - last_stats_time >= LATENCY_REPORT_INTERVAL:
+            print(f"Actions: {sender.format_stats()}")
+            last_stats_time = time.monotonic()
 
-        # Fill the rest of the packet with zeros (no keys)
-        while len(keys) < MAX_PRESSED_KEYS:
-            keys.append((0, 0, 0))
+        # Wait for an action, then take the whole backlog
+        # (addr, action mask, frame_number, trace)
+        messages = []
+        try:
+            messages.append(action_queue.get(timeout=ACTION_KEEPALIVE_INTERVAL / 2))
+            while True:
+                messages.append(action_queue.get_nowait())
+        except queue.Empty:
+            pass
+        except (EOFError, BrokenPipeError, ConnectionError):
+            # manager going away, still send what was taken
+            pass
 
-        # Send the action packet to the game
-        action_packet = b''.join(struct.pack('bbb', key[0], key[1], key[2]) for key in keys)
-        sock.sendto(action_packet, addr)
+        if messages:
+            telemetry.count('actions', len(messages))
+            sender.handle(messages)
+        sender.send_keepalives()
 
+    tracer.report()
+    print(f"Actions: {sender.format_stats()}")
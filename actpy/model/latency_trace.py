@@ -0,0 +1,100 @@
+import time
+import numpy as np
+
+from model.config import LATENCY_TRACE_WINDOW, LATENCY_REPORT_INTERVAL
+
+## ==================================================================
+## Trace Stages
+## ==================================================================
+
+class TraceStage:
+    RECEIVE = 0         # packet received from the socket
+    DECODE = 1          # frame decoded
+    ENQUEUE = 2         # frame published to the consumers
+    DEQUEUE = 3         # frame taken by the consumer
+    INFERENCE = 4       # action picked by the model
+    ACTION_ENQUEUE = 5  # action queued for the game actor
+    SEND = 6            # action packet sent to the game, or skipped as coalesced or unchanged
+    _SIZE = 7
+
+TRACE_STAGE_NAMES = {
+    TraceStage.RECEIVE: "receive",
+    TraceStage.DECODE: "decode",
+    TraceStage.ENQUEUE: "enqueue",
+    TraceStage.DEQUEUE: "dequeue",
+    TraceStage.INFERENCE: "inference",
+    TraceStage.ACTION_ENQUEUE: "action_enqueue",
+    TraceStage.SEND: "send",
+}
+
+## ==================================================================
+## Stamps
+## ==================================================================
+
+# perf_counter is system-wide on Windows (QPC) and Linux (CLOCK_MONOTONIC)
+# so stamps taken in different processes can be compared
+def trace_clock():
+    return time.perf_counter()
+
+def new_trace():
+    # one timestamp per stage, 0 means the stage was not stamped
+    return np.zeros(TraceStage._SIZE, dtype=np.float64)
+
+def stamp(trace, stage, timestamp=None):
+    trace[stage] = trace_clock() if timestamp is None else timestamp
+
+## ==================================================================
+## Latency Tracer
+## ==================================================================
+
+class LatencyTracer:
+    # Keeps the stage latencies of the last `window` traced frames and
+    # reports p50/p95/p99 per stage, each stage measured from the previous
+    # stamped stage, plus the total receive -> send latency
+
+    def __init__(self, window=LATENCY_TRACE_WINDOW, report_interval=LATENCY_REPORT_INTERVAL):
+        self.samples = np.full((window, TraceStage._SIZE + 1), np.nan, dtype=np.float64)
+        self.frame_numbers = np.zeros(window, dtype=np.uint64)
+        self.count = 0
+        self.report_interval = report_interval
+        self.last_report_time = time.monotonic()
+
+    def record(self, frame_number, trace):
+        index = self.count % len(self.samples)
+        self.frame_numbers[index] = frame_number
+        row = self.samples[index]
+        row[:] = np.nan
+
+        previous = None
+        for stage in range(TraceStage._SIZE):
+            if trace[stage] == 0:
+                continue
+            if previous is not None:
+                row[stage] = trace[stage] - trace[previous]
+            previous = stage
+
+        # total
+        if trace[TraceStage.RECEIVE] != 0 and previous is not None:
+            row[TraceStage._SIZE] = trace[previous] - trace[TraceStage.RECEIVE]
+        self.count += 1
+
+    def maybe_report(self):
+        if time.monotonic() - self.last_report_time >= self.report_interval:
+            self.report()
+
+    def report(self):
+        self.last_report_time = time.monotonic()
+        filled = self.samples[:min(self.count, len(self.samples))]
+        if len(filled) == 0:
+            return
+
+        frame_numbers = self.frame_numbers[:len(filled)]
+        print(f"Latency over the last {len(filled)} actions, frames {frame_numbers.min()}-{frame_numbers.max()} (ms):")
+        names = [TRACE_STAGE_NAMES[stage] for stage in range(TraceStage._SIZE)] + ["total"]
+        for column, name in enumerate(names):
+            values = filled[:, column]
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            print(f"  {name:>15}: p50 {p50:7.2f}  p95 {p95:7.2f}  p99 {p99:7.2f}")
@@ -1,28 +1,37 @@
 
 import numpy as np
-from collections import deque
 
-from model.config import FRAMES_PER_STEP, Actions
+from model.config import FRAMES_PER_STEP, Actions, FRAME_MAX_LAG
+from model.frame_stack import FrameStack
+from model.protocol import action_states_to_mask
+from model.latency_trace import TraceStage, stamp
+from model.telemetry import Telemetry
 
 ## ==================================================================
 ## Manual Control Entry
 ## ==================================================================
 
-def manual_control_entry(stop_event, frame_queue, action_queue, display_queue, input_keys_queue):
+def manual_control_entry(stop_event, frame_ring, action_queue, display_queue, input_keys_queue, telemetry_queue=None):
+    telemetry = Telemetry("manual_control", telemetry_queue)
+    telemetry.watch(action_queue, display_queue)
     frame_step = 0
-    frames = deque(maxlen=FRAMES_PER_STEP)
+    frame_stack = FrameStack()
 
     action_states = np.zeros(Actions._SIZE, dtype=np.uint8)
     action_vector = np.zeros(Actions._SIZE, dtype=np.float32)
     action_index = 0 # picked action index
 
     while not stop_event.is_set():
+        if telemetry.maybe_flush():
+            telemetry.set_counters({'ring_dropped': frame_ring.dropped})
 
         # Get the next frame
         try:
-            addr, frame_number, frame, metrics, frame_action_state = frame_queue.get(timeout=1)
+            addr, frame_number, frame, metrics, frame_action_state, trace = frame_ring.get(timeout=1, max_lag=FRAME_MAX_LAG)
         except:
             continue
+        stamp(trace, TraceStage.DEQUEUE)
+        telemetry.count('frames')
 
         # Handle any input keys without blocking
         while not input_keys_queue.empty():
@@ -44,17 +53,20 @@ def manual_control_entry(stop_event, frame_queue, action_queue, display_queue, i
             # Update action states, toggle the action
             action_states[action_index] = state
 
-        # accumulate data
-        frames.append(frame)
+        # accumulate data, the frame is copied from the ring straight into the stack
+        if not frame_ring.read_frame(frame, frame_stack.next_frame()):
+            continue
+        frame_stack.push(frame_number)
         frame_step += 1
 
-        # Send data to update display
-        display_queue.put((frames, metrics, action_states, action_vector, action_index))
+        # Send data to update display, only the newest frame
+        display_queue.put((frame_stack.frame_numbers(), frame_stack.newest(), metrics, action_states, action_vector, action_index))
 
         if frame_step >= FRAMES_PER_STEP:
 
             # Queue action for the game
-            action_queue.put((addr, action_states))
+            stamp(trace, TraceStage.ACTION_ENQUEUE)
+            action_queue.put((addr, action_states_to_mask(action_states), frame_number, trace))
 
             # Update counters
             frame_step = 0
@@ -1,8 +1,15 @@
+import time
+import queue
 import numpy as np
-from collections import deque
 
-from model.config import FRAMES_PER_STEP, Actions, EPSILON, EPSILON_DECAY, EPSILON_MIN
-from model.nn import load_or_build_model, epsilon_greedy_policy, load_or_build_model_from_old_weights
+from model.config import FRAMES_PER_STEP, Actions, EPSILON, EPSILON_DECAY, EPSILON_MIN, COLLECTOR_SESSION_TIMEOUT, \
+    FRAME_MAX_LAG, EXPERIENCE_SENDER_SIZE
+from model.channel import ChannelSender
+from model.frame_stack import FrameStack
+from model.protocol import action_states_to_mask
+from model.latency_trace import TraceStage, stamp
+from model.numpy_inference import load_or_build_inference_model, epsilon_greedy_policy
+from model.telemetry import Telemetry
 
 ## ==================================================================
 ## Utilities
@@ -33,99 +40,200 @@ def _get_reward(prev_metrics, prev_action_index, next_metrics):
     return exp_reward - damage_punish - mana_save_punish - action_punish
 
 
+## ==================================================================
+## Client Session
+## ==================================================================
+
+class ClientSession:
+    # Per game client state: frame stack, toggle states, reward and exploration
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.frame_step = 0
+        self.frame_stack = FrameStack()
+        self.last_frame_time = time.monotonic()
+
+        self.action_vector = np.zeros(Actions._SIZE, dtype=np.float32)
+        self.action_index = 0 # picked action index
+        self.reward = 0
+
+        # Current actions toggle state
+        self.action_states = np.zeros(Actions._SIZE, dtype=np.uint8)
+
+        self.prev_frames = None
+        self.prev_action_states_array = None
+        self.prev_action_index = None
+        self.prev_metrics = None
+
+        self.epsilon = EPSILON
+
+        # Latest frame of the pending step
+        self.frame_number = None
+        self.metrics = None
+        self.trace = None
+
+    def add_frame(self, frame_number, frame, metrics, trace):
+        # accumulate data, returns True when a step is due
+        # - frame None: already copied into frame_stack.next_frame()
+        self.frame_stack.push(frame_number, frame)
+        self.frame_step += 1
+        self.reward += _get_reward(self.prev_metrics, self.prev_action_index, metrics)
+        self.prev_metrics = metrics
+        self.last_frame_time = time.monotonic()
+
+        self.frame_number = frame_number
+        self.metrics = metrics
+        self.trace = trace
+        return self.frame_step >= FRAMES_PER_STEP
+
+    def build_state(self):
+        # the stack is already in model layout, one copy that is kept as the next experience state
+        frames_array = self.frame_stack.copy()
+
+        action_states_array = np.reshape(self.action_states, [1, self.action_states.shape[0]]).copy()
+        return frames_array, action_states_array
+
+    def step(self, frames_array, action_states_array, action_vector, experience_queue, action_queue):
+
+        # Reward the model for previous action
+        if self.reward != 0:
+            print(f"REWARD {self.addr}: {self.reward}")
+
+        # Collect experience, unless nobody consumes it
+        # - addr last, consumers share frame stacks between experiences of the same client
+        if self.prev_frames is not None and experience_queue is not None:
+            experience_queue.put((self.prev_frames, self.prev_action_states_array, self.prev_action_index, self.reward,
+                                  frames_array, action_states_array, False, self.metrics[:3], self.addr))
+
+        # Get action from DQN agent
+        self.action_vector = action_vector
+        self.action_index = epsilon_greedy_policy(action_vector, self.epsilon)
+        stamp(self.trace, TraceStage.INFERENCE)
+        if self.epsilon > EPSILON_MIN:
+            self.epsilon *= EPSILON_DECAY
+        else:
+            print("=== EPSILON MIN REACHED ===")
+
+        # Update action states, toggle the action
+        self.action_states[self.action_index] = 1 - self.action_states[self.action_index]
+
+        # Queue action for the game
+        stamp(self.trace, TraceStage.ACTION_ENQUEUE)
+        action_queue.put((self.addr, action_states_to_mask(self.action_states), self.frame_number, self.trace))
+
+        # Update counters
+        self.prev_frames = frames_array
+        self.prev_action_index = self.action_index
+        self.prev_action_states_array = action_states_array
+        self.frame_step = 0
+        self.reward = 0
+
 ## ==================================================================
 ## Model Collector Entry
 ## ==================================================================
 
-def model_collector_entry(stop_event, frame_queue, action_queue, experience_queue, weights_queue, display_queue):
-    
-    model = load_or_build_model()
+def _step_sessions(model, sessions, experience_queue, action_queue):
+    # Batch the current stacks of every ready client into a single inference
+    states = [session.build_state() for session in sessions]
+    frames_batch = np.concatenate([frames_array for frames_array, _ in states])
+    action_states_batch = np.concatenate([action_states_array for _, action_states_array in states])
+    action_vectors = model.predict_on_batch([frames_batch, action_states_batch])
 
-    # Initialize counters
-    frame_step = 0
-    frame_count = 0
-    frames = deque(maxlen=FRAMES_PER_STEP)
+    for session, (frames_array, action_states_array), action_vector in zip(sessions, states, action_vectors):
+        session.step(frames_array, action_states_array, action_vector, experience_queue, action_queue)
 
-    action_vector = np.zeros(Actions._SIZE, dtype=np.float32)
-    action_index = 0 # picked action index
-    reward = 0
+def model_collector_entry(stop_event, frame_ring, action_queue, experience_queue, weight_channel, display_queue,
+                          telemetry_queue=None):
+    telemetry = Telemetry("model_collector", telemetry_queue)
 
-    # Current actions toggle state
-    action_states = np.zeros(Actions._SIZE, dtype=np.uint8)
+    # Experiences go through a sender thread, a trainer that falls behind blocks
+    # that thread and never the actions; beyond its buffer they are dropped and counted
+    experience_sender = ChannelSender(experience_queue, EXPERIENCE_SENDER_SIZE) if experience_queue is not None else None
+    telemetry.watch(action_queue, experience_queue, experience_sender, display_queue)
 
-    prev_frames = None
-    prev_action_states_array = None
-    prev_action_index = None
-    prev_metrics = None
+    # NumPy forward pass, the collector does not load TensorFlow
+    model = load_or_build_inference_model()
 
-    epsilon = EPSILON
+    # One session per game client, keyed by source address
+    sessions = {}
+    display_addr = None # client shown on the debug display
+    frame_count = 0
 
     while not stop_event.is_set():
-
-        # Get the next frame
+        if telemetry.maybe_flush():
+            telemetry.set_counters({'steps': frame_count, 'ring_dropped': frame_ring.dropped})
+            telemetry.gauge('sessions', len(sessions))
+            if experience_queue is not None:
+                telemetry.gauge('experience_queue_depth', experience_queue.qsize())
+                telemetry.gauge('experience_sender_depth', experience_sender.qsize())
+
+        # Get the next frame, then route everything else already available in this tick
+        # under load, skip to the newest frames instead of acting on stale ones
+        max_lag = FRAME_MAX_LAG * max(len(sessions), 1)
         try:
-            addr, frame_number, frame, metrics, frame_action_state = frame_queue.get(timeout=1)
+            item = frame_ring.get(timeout=1, max_lag=max_lag)
         except:
             continue
 
-        # accumulate data
-        frames.append(frame)
-        frame_step += 1
-        reward += _get_reward(prev_metrics, prev_action_index, metrics)
-        prev_metrics = metrics
-
-        # don't take actions from game, they are delayed
-
-        # # get last action states
-        # action_states.fill(0)
-        # for i, action_state in enumerate(frame_action_state):
-        #     action_states[i] = action_state
-
-        # Send data to update display
-        display_queue.put((frames, metrics, action_states, action_vector, action_index))
-
-        if frame_step >= FRAMES_PER_STEP:
-
-            # turn frames to numpy array
-            frames_array = np.array(frames, dtype=np.uint8)   
-            frames_array = np.transpose(frames_array, (1, 2, 0))
-            frames_array = np.reshape(frames_array, [1, frames_array.shape[0], frames_array.shape[1], frames_array.shape[2]])
-
-            action_states_array = np.reshape(action_states, [1, action_states.shape[0]])
-
-            # Reward the model for previous action
-            if reward != 0:
-                print(f"REWARD: {reward}")
-
-            # Collect experience
-            if prev_frames is not None:                
-                experience_queue.put((prev_frames, prev_action_states_array, prev_action_index, reward, frames_array, action_states_array, False))
-
-            # Get action from DQN agent
-            action_vector = model.predict([frames_array, action_states_array])[0]
-            action_index = epsilon_greedy_policy(action_vector, epsilon)            
-            if epsilon > EPSILON_MIN:
-                epsilon *= EPSILON_DECAY
-            else:
-                print("=== EPSILON MIN REACHED ===")
-            
-            # Update action states, toggle the action
-            action_states[action_index] = 1 - action_states[action_index]
-
-            # Queue action for the game
-            action_queue.put((addr, action_states))
-
-            # Update counters
-            prev_frames = frames_array
-            prev_action_index = action_index
-            prev_action_states_array = action_states_array
-            frame_count += 1
-            frame_step = 0
-            reward = 0
-
-            # Check if we need to synchronize weights
-            if weights_queue.qsize() > 0:
-                sync_weights = weights_queue.get()
-                model.set_weights(sync_weights)
-                epsilon = EPSILON
-
+        ready = []
+        while True:
+            addr, frame_number, frame, metrics, frame_action_state, trace = item
+            stamp(trace, TraceStage.DEQUEUE)
+            telemetry.count('frames')
+
+            if addr not in sessions:
+                print(f"New client session: {addr}")
+                sessions[addr] = ClientSession(addr)
+            session = sessions[addr]
+
+            # a client got a second step in the same tick, run the pending batch first
+            if session in ready:
+                _step_sessions(model, ready, experience_sender, action_queue)
+                frame_count += len(ready)
+                ready = []
+
+            # don't take actions from game, they are delayed
+
+            # # get last action states
+            # session.action_states.fill(0)
+            # for i, action_state in enumerate(frame_action_state):
+            #     session.action_states[i] = action_state
+
+            # copy the frame from the ring straight into the session stack, drop it if it was overwritten meanwhile
+            frame_read = frame_ring.read_frame(frame, session.frame_stack.next_frame())
+            if frame_read and session.add_frame(frame_number, None, metrics, trace):
+                ready.append(session)
+
+            # Send data to update display
+            # - only the newest frame, the display keeps the older ones by frame number
+            if display_addr not in sessions:
+                display_addr = addr
+            if frame_read and addr == display_addr:
+                display_queue.put((session.frame_stack.frame_numbers(), session.frame_stack.newest(), metrics,
+                                   session.action_states, session.action_vector, session.action_index))
+
+            try:
+                item = frame_ring.get(timeout=0, max_lag=max_lag)
+            except queue.Empty:
+                break
+
+        # One inference for all the clients that completed a step
+        if ready:
+            _step_sessions(model, ready, experience_sender, action_queue)
+            frame_count += len(ready)
+
+        # Drop clients that stopped sending frames
+        now = time.monotonic()
+        for addr in [addr for addr, session in sessions.items() if now - session.last_frame_time > COLLECTOR_SESSION_TIMEOUT]:
+            print(f"Client session timed out: {addr}")
+            del sessions[addr]
+
+        # Check if we need to synchronize weights
+        if weight_channel.poll(model):
+            telemetry.count('weight_syncs')
+            for session in sessions.values():
+                session.epsilon = EPSILON
+
+    if experience_sender is not None:
+        experience_sender.close()
+    weight_channel.close()
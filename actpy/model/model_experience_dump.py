@@ -1,28 +1,27 @@
-from struct import pack
+from model.experience_store import ExperienceWriter
+from model.telemetry import Telemetry
 
 ## ==================================================================
 ## Model Experience Dump Entry
 ## ==================================================================
 
-def model_experience_dump_entry(stop_event, experience_queue):
+def model_experience_dump_entry(stop_event, experience_queue, telemetry_queue=None):
+    telemetry = Telemetry("experience_dump", telemetry_queue)
 
-    # Save all the experiences to a file
-    with open("experiences.bin", "wb") as f:
+    # Save all the experiences to the experience store
+    writer = ExperienceWriter()
+    try:
         while not stop_event.is_set():
+            telemetry.maybe_flush()
 
             # Get the next experience
             try:
-                prev_frames, prev_action_index, reward, frames_array, done = experience_queue.get(timeout=1)
+                experience = experience_queue.get(timeout=1)
             except:
                 continue
 
-            # Save the experience to the file
-            f.write(prev_frames)
-            f.write(pack('i', prev_action_index))
-            f.write(pack('f', reward))
-            f.write(frames_array)
-            f.write(pack('i', done))
-
-    
-
-        
\ No newline at end of file
+            # Save the experience to the store, the client addr comes last and keys the stack sharing
+            writer.append(*experience)
+            telemetry.count('experiences')
+    finally:
+        writer.close()
@@ -1,55 +1,76 @@
 import os
-import random
 import numpy as np
-from collections import deque
 
-from model.config import MEMORY_SIZE, BATCH_SIZE, GAMMA, UPDATE_TARGET_MODEL_EVERY, SAVE_WEIGHTS_EVERY
-from model.nn import load_or_build_model, load_or_build_model_from_old_weights
+from model.config import BATCH_SIZE, UPDATE_TARGET_MODEL_EVERY, SAVE_WEIGHTS_EVERY, PRIORITIZED_REPLAY
+from model.nn import load_or_build_model, load_or_build_model_from_old_weights, train_minibatch, build_target_model
+from model.replay_memory import ReplayMemory, PrioritizedReplayMemory
+from model.target_cache import TargetQCache
+from model.checkpoints import CheckpointWriter
+from model.telemetry import Telemetry
 
 ## ==================================================================
 ## Model Trainer Entry
 ## ==================================================================
 
-def model_trainer_entry(stop_event, experience_queue, weights_queue):
+def model_trainer_entry(stop_event, experience_queue, weight_channel, telemetry_queue=None):
+    telemetry = Telemetry("model_trainer", telemetry_queue)
 
     model = load_or_build_model()
-    target_model = load_or_build_model()
+    target_model = build_target_model(model)
+    target_cache = TargetQCache() # target max Q per experience id, valid until the next target sync
     model.summary()
 
-    memory = deque(maxlen=MEMORY_SIZE)
-    train_count = 0
+    memory = PrioritizedReplayMemory() if PRIORITIZED_REPLAY else ReplayMemory()
+    checkpoints = CheckpointWriter()
+    train_count = checkpoints.last_step # continue the step count of the resumed checkpoint
+    losses = []
 
     while not stop_event.is_set():
 
         # Add all pending experiences to memory
-        for _ in range(experience_queue.qsize()):
+        pending = experience_queue.qsize()
+        for _ in range(pending):
             prev_frames, prev_action_states_array, prev_action_index, \
-                reward, frames_array, action_states_array, done = experience_queue.get()
-            memory.append((prev_frames, prev_action_states_array, prev_action_index, reward, frames_array, action_states_array, done))
+                reward, frames_array, action_states_array, done, metrics, addr = experience_queue.get()
+            memory.append(prev_frames, prev_action_states_array, prev_action_index, reward, frames_array, action_states_array, done,
+                          key=addr)
+        telemetry.count('experiences', pending)
+
+        # a growing backlog means the trainer falls behind the collector
+        if telemetry.maybe_flush():
+            telemetry.gauge('experience_backlog', experience_queue.qsize())
+            telemetry.gauge('memory_size', len(memory))
 
         # Check if we can replay
         if len(memory) > BATCH_SIZE:
-            minibatch = random.sample(memory, BATCH_SIZE)
-            for state, action_states, action, reward, next_state, next_action_states, done in minibatch:
-                target = reward
-                if not done:
-                    # Use target_model for the Q-value prediction
-                    target = (reward + GAMMA * np.amax(target_model.predict([next_state, next_action_states])[0]))
-                target_f = model.predict([state, action_states])
-                target_f[0][action] = target
-                model.train_on_batch([state, action_states], target_f)
+            ids, minibatch, weights = memory.sample(BATCH_SIZE)
+            loss, td_errors = train_minibatch(model, target_model, *minibatch, ids=ids, target_cache=target_cache,
+                                              sample_weight=weights)
+            memory.update_priorities(ids, td_errors)
+            losses.append(loss)
 
             # Increment the frame count
             train_count += 1
+            telemetry.count('train_steps')
+            telemetry.gauge('loss', float(losses[-1]))
             print(f"Trained {train_count} times")
 
             # Update the target model
             if train_count % UPDATE_TARGET_MODEL_EVERY == 0:
                 # Copy weights from model to target_model
                 target_model.set_weights(model.get_weights())
+                target_cache.invalidate()
+                print(target_cache.format_stats())
 
             # Sync weights with the model collector
             if train_count % SAVE_WEIGHTS_EVERY == 0:
-                weights_queue.put(model.get_weights())
-                model.save_weights(f"model_weights_{train_count}.h5")
+                weights = model.get_weights()
+                weight_channel.publish(weights)
+
+                # Checkpoint in the background, scored by the recent loss
+                checkpoints.save(train_count, weights, score=-float(np.mean(losses)))
+                losses = []
+
+    checkpoints.close()
+    weight_channel.close()
 
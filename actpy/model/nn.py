@@ -1,13 +1,14 @@
 import os
 import numpy as np
-import random
-from keras.models import Model, Sequential
+from keras.models import Model, Sequential, clone_model
 from keras.layers import Input, Concatenate, Dense, Flatten, Conv2D, LeakyReLU
 from keras.optimizers import Adam
 from collections import deque
 
 from model.config import FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP, Actions, \
-    MODEL_WEIGHTS_FILE, CONVOLUTIONAL_LAYERS, DENSE_LAYERS, LEARNING_RATE
+    MODEL_WEIGHTS_FILE, CONVOLUTIONAL_LAYERS, DENSE_LAYERS, LEARNING_RATE, GAMMA
+from model.numpy_inference import epsilon_greedy_policy
+from model.checkpoints import load_latest_checkpoint
 
 ## ==================================================================
 ## Methods
@@ -15,10 +16,23 @@ from model.config import FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP, Actions, \
 
 def load_or_build_model():
     model = build_model()
-    if os.path.exists(MODEL_WEIGHTS_FILE):
+
+    # resume from the latest checkpoint, then the legacy weights file
+    checkpoint = load_latest_checkpoint()
+    if checkpoint is not None:
+        step, weights = checkpoint
+        model.set_weights(weights)
+        print(f"Model resumed from checkpoint {step}")
+    elif os.path.exists(MODEL_WEIGHTS_FILE):
         model.load_weights(MODEL_WEIGHTS_FILE)
     return model
 
+def build_target_model(model):
+    # Same architecture and weights, no optimizer: the target network only predicts
+    target_model = clone_model(model)
+    target_model.set_weights(model.get_weights())
+    return target_model
+
 def load_or_build_model_from_old_weights():
     # Load old model
     model_old = build_old_model()
@@ -98,8 +112,32 @@ def build_model():
     model.compile(loss='mse', optimizer=Adam(learning_rate=LEARNING_RATE))
     return model
 
-def epsilon_greedy_policy(prediction, epsilon=0):
-    # Epsilon-greedy action selection
-    if np.random.rand() <= epsilon:
-        return random.randrange(Actions._SIZE)
-    return np.argmax(prediction)
+## ==================================================================
+## Batched Replay Step
+## ==================================================================
+
+def train_minibatch(model, target_model, states, action_states, actions, rewards, next_states, next_action_states, dones,
+                    ids=None, target_cache=None, sample_weight=None):
+    # -> (loss, TD errors of the taken actions before the update, for prioritized replay)
+    # Use target_model for the Q-value prediction, only for next states missing from the cache
+    if target_cache is None:
+        next_max_q = np.amax(target_model.predict_on_batch([next_states, next_action_states]), axis=1)
+    else:
+        hit, next_max_q = target_cache.lookup(ids)
+        miss = ~hit
+        if miss.any():
+            next_q = target_model.predict_on_batch([next_states[miss], next_action_states[miss]])
+            next_max_q[miss] = np.amax(next_q, axis=1)
+            target_cache.store(ids[miss], next_max_q[miss])
+
+    # terminal states only keep the reward
+    targets = rewards + GAMMA * next_max_q * (1 - dones)
+
+    # Only the taken action's Q-value moves towards the target
+    target_f = np.array(model.predict_on_batch([states, action_states]))
+    td_errors = targets - target_f[np.arange(len(actions)), actions]
+    target_f[np.arange(len(actions)), actions] = targets
+
+    # Single gradient update for the whole minibatch, weighted by the importance-sampling weights if any
+    loss = model.train_on_batch([states, action_states], target_f, sample_weight=sample_weight)
+    return loss, td_errors
@@ -0,0 +1,214 @@
+import os
+import random
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from model.config import FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP, Actions, \
+    INFERENCE_WEIGHTS_FILE, MODEL_WEIGHTS_FILE, CONVOLUTIONAL_LAYERS, DENSE_LAYERS
+from model.checkpoints import load_latest_checkpoint, load_weights_file, save_weights_file
+
+# Keras LeakyReLU default slope, every conv and dense layer is followed by one
+LEAKY_RELU_ALPHA = 0.3
+
+## ==================================================================
+## Architecture (mirrors nn.build_model)
+## ==================================================================
+
+def _conv_output_size(size, kernel, stride):
+    # 'valid' padding
+    return (size - kernel) // stride + 1
+
+def inference_layer_shapes():
+    # Keras get_weights() order: [kernel, bias] for each conv, dense and the output layer
+    shapes = []
+    height, width, channels = FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP
+    for layer in CONVOLUTIONAL_LAYERS:
+        (kh, kw), (sh, sw) = layer["kernel_size"], layer["strides"]
+        shapes += [(kh, kw, channels, layer["filters"]), (layer["filters"],)]
+        height, width, channels = _conv_output_size(height, kh, sh), _conv_output_size(width, kw, sw), layer["filters"]
+
+    units = height * width * channels + Actions._SIZE # flattened frames + toggle states
+    for layer in DENSE_LAYERS + [{"units": Actions._SIZE, "activation": "linear"}]:
+        shapes += [(units, layer["units"]), (layer["units"],)]
+        units = layer["units"]
+    return shapes
+
+def _check_activation(layer):
+    activation = layer.get("activation", "linear")
+    if activation not in ("linear", "relu", None):
+        raise Exception(f"Unsupported activation for NumPy inference: {activation}")
+    return activation
+
+def epsilon_greedy_policy(prediction, epsilon=0):
+    # Epsilon-greedy action selection
+    if np.random.rand() <= epsilon:
+        return random.randrange(Actions._SIZE)
+    return np.argmax(prediction)
+
+## ==================================================================
+## NumPy Inference Model
+## ==================================================================
+
+class NumpyInferenceModel:
+    # Forward pass of nn.build_model in plain NumPy, float32 throughout.
+    # Convolutions are im2col (strided view copied into a preallocated
+    # patch buffer) followed by one matmul. Intermediate buffers are
+    # allocated once per batch size and reused.
+    # Same interface as the Keras model for the collector: predict_on_batch,
+    # get_weights and set_weights.
+
+    def __init__(self, weights=None):
+        self.shapes = inference_layer_shapes()
+        if weights is None:
+            weights = self._glorot_uniform()
+        self.set_weights(weights)
+        self.buffers = {} # batch size -> intermediate buffers
+
+    def _glorot_uniform(self):
+        # Keras default initializers: glorot uniform kernels, zero biases
+        rng = np.random.default_rng()
+        weights = []
+        for shape in self.shapes:
+            if len(shape) == 1:
+                weights.append(np.zeros(shape, dtype=np.float32))
+                continue
+            receptive_field = int(np.prod(shape[:-2]))
+            fan_in, fan_out = shape[-2] * receptive_field, shape[-1] * receptive_field
+            limit = np.sqrt(6 / (fan_in + fan_out))
+            weights.append(rng.uniform(-limit, limit, size=shape).astype(np.float32))
+        return weights
+
+    def get_weights(self):
+        return [w.copy() for w in self.weights]
+
+    def set_weights(self, weights):
+        if len(weights) != len(self.shapes):
+            raise Exception(f"Expected {len(self.shapes)} weight arrays, got {len(weights)}")
+        for w, shape in zip(weights, self.shapes):
+            if tuple(w.shape) != shape:
+                raise Exception(f"Weight shape mismatch: expected {shape}, got {tuple(w.shape)}")
+
+        # own copies, callers may reuse their arrays (see WeightChannel.poll)
+        self.weights = [np.array(w, dtype=np.float32) for w in weights]
+
+        # conv kernels as (kh * kw * cin, cout) matrices, matching the patch layout
+        self.conv_layers = []
+        for i, layer in enumerate(CONVOLUTIONAL_LAYERS):
+            kernel, bias = self.weights[2 * i], self.weights[2 * i + 1]
+            self.conv_layers.append((kernel.reshape(-1, kernel.shape[-1]), bias, kernel.shape[:2], layer["strides"],
+                                     _check_activation(layer)))
+
+        # hidden dense layers are followed by LeakyReLU, the output layer is linear
+        offset = 2 * len(CONVOLUTIONAL_LAYERS)
+        self.dense_layers = []
+        for i, layer in enumerate(DENSE_LAYERS + [None]):
+            kernel, bias = self.weights[offset + 2 * i], self.weights[offset + 2 * i + 1]
+            self.dense_layers.append((kernel, bias, None if layer is None else _check_activation(layer)))
+
+    ## Buffers
+    ## ------------------------------------------------------------------
+
+    def _allocate(self, batch):
+        buffers = {'conv': [], 'dense': []}
+        height, width, channels = FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP
+        for kernel, bias, (kh, kw), (sh, sw), activation in self.conv_layers:
+            height, width = _conv_output_size(height, kh, sh), _conv_output_size(width, kw, sw)
+            patches = np.empty((batch, height, width, kh, kw, channels), dtype=np.float32)
+            channels = kernel.shape[1]
+            output = np.empty((batch, height, width, channels), dtype=np.float32)
+            buffers['conv'].append((patches, output))
+
+        # flattened conv output and toggle states side by side, the concatenation is free
+        flat_size = height * width * channels
+        buffers['flat_size'] = flat_size
+        buffers['features'] = np.empty((batch, flat_size + Actions._SIZE), dtype=np.float32)
+        for kernel, bias, activation in self.dense_layers:
+            buffers['dense'].append(np.empty((batch, kernel.shape[1]), dtype=np.float32))
+
+        largest = max([output.size for _, output in buffers['conv']] + [output.size for output in buffers['dense']])
+        buffers['scratch'] = np.empty(largest, dtype=np.float32)
+        return buffers
+
+    def _activate(self, x, activation, scratch):
+        # layer activation followed by LeakyReLU, in place
+        if activation == "relu":
+            # LeakyReLU leaves non-negative values unchanged
+            np.maximum(x, 0, out=x)
+            return
+
+        # max(x, alpha * x) for alpha < 1
+        tmp = scratch[:x.size].reshape(x.shape)
+        np.multiply(x, LEAKY_RELU_ALPHA, out=tmp)
+        np.maximum(x, tmp, out=x)
+
+    ## Forward Pass
+    ## ------------------------------------------------------------------
+
+    def predict_on_batch(self, inputs):
+        frames, action_states = inputs
+        batch = frames.shape[0]
+        if batch not in self.buffers:
+            self.buffers[batch] = self._allocate(batch)
+        buffers = self.buffers[batch]
+        scratch = buffers['scratch']
+
+        x = frames
+        for (kernel, bias, (kh, kw), (sh, sw), activation), (patches, output) in zip(self.conv_layers, buffers['conv']):
+            # (B, oh, ow, kh, kw, C) view of the input windows, copied (and cast) into the patch buffer
+            _, oh, ow, _, _, channels = patches.shape
+            sb, sy, sx, sc = x.strides
+            windows = as_strided(x, shape=patches.shape, strides=(sb, sy * sh, sx * sw, sy, sx, sc), writeable=False)
+            np.copyto(patches, windows)
+
+            out = output.reshape(-1, kernel.shape[1])
+            np.matmul(patches.reshape(out.shape[0], -1), kernel, out=out)
+            out += bias
+            self._activate(output, activation, scratch)
+            x = output
+
+        # Flatten (channels last, same order as Keras) and concatenate the toggle states
+        features = buffers['features']
+        flat_size = buffers['flat_size']
+        features[:, :flat_size] = x.reshape(batch, -1)
+        features[:, flat_size:] = np.reshape(action_states, (batch, Actions._SIZE))
+
+        # Dense layers, the output layer (no activation) stays linear
+        x = features
+        for (kernel, bias, activation), output in zip(self.dense_layers, buffers['dense']):
+            np.matmul(x, kernel, out=output)
+            output += bias
+            if activation is not None:
+                self._activate(output, activation, scratch)
+            x = output
+
+        return x.copy()
+
+## ==================================================================
+## Loading
+## ==================================================================
+
+def load_or_build_inference_model(path=INFERENCE_WEIGHTS_FILE, keras_path=MODEL_WEIGHTS_FILE):
+    # latest checkpoint first, then the exported weights file, then the Keras
+    # weights the trainer starts from. Random weights only when there are none.
+    checkpoint = load_latest_checkpoint()
+    if checkpoint is not None:
+        step, weights = checkpoint
+        print(f"Inference model resumed from checkpoint {step}")
+        return NumpyInferenceModel(weights)
+
+    # an export older than the Keras weights is stale
+    if os.path.exists(path) and not (os.path.exists(keras_path) and os.path.getmtime(keras_path) > os.path.getmtime(path)):
+        return NumpyInferenceModel(load_weights_file(path))
+
+    if os.path.exists(keras_path):
+        # one time conversion, needs Keras, later starts load the export
+        from model.nn import build_model
+        model = build_model()
+        model.load_weights(keras_path)
+        weights = model.get_weights()
+        save_weights_file(weights, path)
+        print(f"Exported {keras_path} to {path}")
+        return NumpyInferenceModel(weights)
+
+    print("No model weights found, the inference model starts from random weights")
+    return NumpyInferenceModel()
@@ -0,0 +1,105 @@
+import queue
+import threading
+import numpy as np
+
+from model.config import BATCH_SIZE, MEMORY_SIZE, PRIORITIZED_REPLAY, \
+    OFFLINE_EPOCHS, OFFLINE_STEPS_PER_EXPERIENCE, OFFLINE_PREFETCH_BATCHES
+from model.prioritized_replay import PrioritizedSampler
+
+## ==================================================================
+## Offline Batch Stream
+## ==================================================================
+
+class OfflineBatchStream:
+    # Background producer for the offline trainer. Walks the experience
+    # store in recording order, like the collector would feed the online
+    # trainer, and after each experience samples `steps_per_experience`
+    # minibatches from the last `window` experiences (the shuffle buffer).
+    # Ready-made batches wait in a bounded queue so reading, unpacking and
+    # batch assembly overlap with training.
+    # Prioritized, the window is sampled by TD error like the online replay
+    # memory. Priorities of prefetched batches lag by up to `prefetch` steps.
+
+    def __init__(self, reader, epochs=OFFLINE_EPOCHS, steps_per_experience=OFFLINE_STEPS_PER_EXPERIENCE,
+                 window=MEMORY_SIZE, batch_size=BATCH_SIZE, prefetch=OFFLINE_PREFETCH_BATCHES,
+                 prioritized=PRIORITIZED_REPLAY):
+        self.reader = reader
+        self.epochs = epochs
+        self.steps_per_experience = steps_per_experience
+        self.window = window
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng()
+        self.sampler = PrioritizedSampler(len(reader)) if prioritized and len(reader) > 0 else None
+
+        self.batches = queue.Queue(maxsize=prefetch)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+
+    def __len__(self):
+        # number of batches the stream will produce
+        per_epoch = max(len(self.reader) - self.batch_size, 0) * self.steps_per_experience
+        return per_epoch * self.epochs
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        # unblock the producer if it waits on a full queue
+        while not self.batches.empty():
+            self.batches.get_nowait()
+        self.thread.join()
+
+    def __iter__(self):
+        # -> (experience ids, minibatch, importance-sampling weights or None)
+        while True:
+            item = self.batches.get()
+            if item is None:
+                return
+            yield item
+
+    def update_priorities(self, ids, td_errors):
+        if self.sampler is not None:
+            self.sampler.update(ids, td_errors)
+
+    def _produce(self):
+        try:
+            for epoch in range(self.epochs):
+                if self.sampler is not None:
+                    self.sampler.remove(np.arange(len(self.reader))) # each epoch slides the window again
+
+                for index in range(len(self.reader)):
+                    # the shuffle buffer holds the experiences read so far, bounded by the window
+                    first = max(0, index + 1 - self.window)
+                    if self.sampler is not None:
+                        self.sampler.add(index)
+                        if first > 0:
+                            self.sampler.remove(first - 1)
+                    if index + 1 - first <= self.batch_size:
+                        continue
+
+                    for _ in range(self.steps_per_experience):
+                        if not self._put(self._sample(first, index + 1)):
+                            return
+        finally:
+            self._put(None)
+
+    def _sample(self, first, end):
+        if self.sampler is None:
+            indices = np.sort(first + self.rng.choice(end - first, self.batch_size, replace=False))
+            return *self.reader.gather(indices), None
+
+        # sorted for sequential reads of the memory-mapped store
+        indices, weights = self.sampler.sample(self.batch_size)
+        order = np.argsort(indices)
+        return *self.reader.gather(indices[order]), weights[order]
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
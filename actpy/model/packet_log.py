@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import numpy as np
+
+from model.config import PACKET_LOG_DIR, PACKET_LOG_FLUSH_INTERVAL
+
+## ==================================================================
+## On-disk Layout
+## ==================================================================
+
+# A packet log is a directory with a json header, the raw datagrams
+# appended back to back, and a fixed-stride index with one record per
+# datagram. The index is written after the data, so an index record
+# always points at complete bytes, and a log that was not closed cleanly
+# is still readable up to its last complete record.
+PACKET_LOG_VERSION = 1
+HEADER_FILE = "header.json"
+DATA_FILE = "packets.bin"
+INDEX_FILE = "index.bin"
+
+PACKET_INDEX_DTYPE = np.dtype([
+    ("time", "<f8"),   # arrival, seconds since the start of the recording
+    ("offset", "<u8"), # in the data file
+    ("length", "<u4"),
+    ("host", "S45"),   # source address, as received
+    ("port", "<u2"),
+])
+
+## ==================================================================
+## Recorder
+## ==================================================================
+
+class PacketLogWriter:
+    # Appends every received datagram with its arrival time and source
+    # address. Called from the ingest receiver thread, so writes only go
+    # to the file buffers, flushes happen at most every flush interval.
+
+    def __init__(self, path=PACKET_LOG_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        self.header = {"version": PACKET_LOG_VERSION, "start_time": time.time(), "count": 0, "bytes": 0}
+        self.data_file = open(os.path.join(path, DATA_FILE), "wb")
+        self.index_file = open(os.path.join(path, INDEX_FILE), "wb")
+        self.record = np.zeros(1, dtype=PACKET_INDEX_DTYPE)
+        self.start = time.monotonic()
+        self.last_flush_time = self.start
+        self._write_header()
+
+    def append(self, packet, addr, now):
+        # now: time.monotonic() of the arrival
+        self.data_file.write(packet)
+        self.record[0] = (now - self.start, self.header["bytes"], len(packet), addr[0].encode(), addr[1])
+        self.index_file.write(self.record.tobytes())
+        self.header["count"] += 1
+        self.header["bytes"] += len(packet)
+
+        if now - self.last_flush_time >= PACKET_LOG_FLUSH_INTERVAL:
+            self.flush()
+            self.last_flush_time = now
+
+    def flush(self):
+        self.data_file.flush()
+        self.index_file.flush()
+        self._write_header()
+
+    def close(self):
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+    def _write_header(self):
+        # replace the header in one step so readers never see a partial file
+        header_file = os.path.join(self.path, HEADER_FILE)
+        with open(header_file + ".tmp", "w") as f:
+            json.dump(self.header, f, indent=2)
+        os.replace(header_file + ".tmp", header_file)
+
+## ==================================================================
+## Memory-mapped Reader
+## ==================================================================
+
+class PacketLogReader:
+
+    def __init__(self, path=PACKET_LOG_DIR):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        if self.header["version"] != PACKET_LOG_VERSION:
+            raise Exception(f"Unsupported packet log version {self.header['version']}")
+
+        self.index = self._map(INDEX_FILE, PACKET_INDEX_DTYPE)
+        self.data = self._map(DATA_FILE, np.uint8)
+
+        # only trust records whose bytes are complete
+        self.count = len(self.index)
+        while self.count > 0 and self.index[self.count - 1]["offset"] + self.index[self.count - 1]["length"] > len(self.data):
+            self.count -= 1
+
+    def _map(self, name, dtype):
+        filename = os.path.join(self.path, name)
+        rows = os.path.getsize(filename) // np.dtype(dtype).itemsize
+        if rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode="r", shape=(rows,))
+
+    def __len__(self):
+        return self.count
+
+    def read(self, index):
+        # -> (arrival time, (host, port), packet bytes)
+        record = self.index[index]
+        offset = int(record["offset"])
+        packet = self.data[offset:offset + int(record["length"])].tobytes()
+        return float(record["time"]), (record["host"].decode(), int(record["port"])), packet
+
+    def duration(self):
+        return float(self.index[self.count - 1]["time"]) if self.count else 0.0
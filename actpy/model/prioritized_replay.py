@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+
+from model.config import PRIORITY_ALPHA, PRIORITY_BETA, PRIORITY_BETA_STEPS, PRIORITY_EPSILON
+
+## ==================================================================
+## Sum Tree
+## ==================================================================
+
+class SumTree:
+    # Complete binary tree in a flat array, node i has children 2i and 2i+1,
+    # leaves start at `size` (capacity rounded up to a power of two). Each
+    # node holds the sum of its leaves, so a value in [0, total) leads to a
+    # leaf with probability proportional to its priority in O(log n).
+    # Updates and lookups work on whole batches, one numpy op per level.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.size.bit_length() - 1
+        self.nodes = np.zeros(2 * self.size, dtype=np.float64)
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indices):
+        return self.nodes[self.size + indices]
+
+    def update(self, indices, priorities):
+        nodes = self.size + np.asarray(indices, dtype=np.int64)
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, values):
+        # values in [0, total) -> leaf indices
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            # rounding can put a value past the last non-empty leaf, never go into an empty subtree
+            go_right = (values >= self.nodes[left]) & (self.nodes[left + 1] > 0)
+            values -= self.nodes[left] * go_right
+            nodes = left + go_right
+        return nodes - self.size
+
+## ==================================================================
+## Prioritized Sampler
+## ==================================================================
+
+class PrioritizedSampler:
+    # Proportional prioritized sampling over indices [0, capacity), the
+    # owner maps them to its storage (replay memory slots, store indices).
+    # New items get the highest priority seen so they are replayed at least
+    # once, trained items get (|TD error| + epsilon)^alpha. Importance-sampling
+    # weights correct the bias, normalized by the largest in the batch.
+    # Locked, the offline stream samples on its own thread.
+
+    def __init__(self, capacity, alpha=PRIORITY_ALPHA, beta=PRIORITY_BETA, beta_steps=PRIORITY_BETA_STEPS,
+                 epsilon=PRIORITY_EPSILON):
+        self.tree = SumTree(capacity)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / max(beta_steps, 1)
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.rng = np.random.default_rng()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, indices):
+        indices = np.atleast_1d(indices)
+        with self.lock:
+            self.count += int(np.count_nonzero(~self.active[indices]))
+            self.active[indices] = True
+            self.tree.update(indices, self.max_priority)
+
+    def remove(self, indices):
+        indices = np.atleast_1d(indices)
+        with self.lock:
+            self.count -= int(np.count_nonzero(self.active[indices]))
+            self.active[indices] = False
+            self.tree.update(indices, 0.0)
+
+    def sample(self, batch_size):
+        # -> (indices, importance-sampling weights), stratified over the total priority
+        with self.lock:
+            segment = self.tree.total() / batch_size
+            values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+            indices = self.tree.find(values)
+
+            probabilities = self.tree.get(indices) / self.tree.total()
+            weights = (self.count * probabilities) ** -self.beta
+            self.beta = min(1.0, self.beta + self.beta_increment)
+        return indices, (weights / weights.max()).astype(np.float32)
+
+    def update(self, indices, td_errors):
+        # items removed since they were sampled keep their zero priority
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        with self.lock:
+            keep = self.active[indices]
+            self.tree.update(indices[keep], priorities[keep])
+            if keep.any():
+                self.max_priority = max(self.max_priority, float(priorities[keep].max()))
@@ -0,0 +1,155 @@
+import struct
+import numpy as np
+
+from model.config import FRAME_PACKET_HEADER_SIZE, MAX_PORTALS, MAX_PRESSED_KEYS, NO_KEY_VALUE, \
+    FRAGMENT_HEADER_SIZE, FRAGMENT_DATA_SIZE, MAX_PACKET_SIZE, Actions, ACTION_TO_KEY_MAP, KEY_TO_ACTION_MAP
+
+## ==================================================================
+## Packet Layouts (see capp/protocol.hpp)
+## ==================================================================
+
+# FramePacket header, from client to server, followed by `length` bytes of compressed frame
+FRAME_PACKET_HEADER_DTYPE = np.dtype([
+    ('hp', '<f4'),
+    ('mp', '<f4'),
+    ('exp', '<f4'),
+    ('map_width', '<u2'),
+    ('map_height', '<u2'),
+    ('player_x', '<u2'),
+    ('player_y', '<u2'),
+    ('portal_x', '<u2', MAX_PORTALS),
+    ('portal_y', '<u2', MAX_PORTALS),
+    ('version', 'u1'), # frame encoding, was zero padding before versions
+    ('flags', 'u1'),
+    ('reserved', '<u2'), # aligns frame_number to 8 bytes
+    ('frame_number', '<u8'),
+    ('pressed_keys', 'u1', (MAX_PRESSED_KEYS, 3)), # isVirtualKey, isExtended, keyCode
+    ('length', '<u8'),
+])
+assert FRAME_PACKET_HEADER_DTYPE.itemsize == FRAME_PACKET_HEADER_SIZE
+
+# Same header as a precompiled struct, faster than the dtype for a single packet,
+# version and flags are read separately with FRAME_ENCODING_STRUCT
+FRAME_PACKET_HEADER_STRUCT = struct.Struct(f"<3f4H{MAX_PORTALS}H{MAX_PORTALS}H4xQ{MAX_PRESSED_KEYS * 3}sQ")
+assert FRAME_PACKET_HEADER_STRUCT.size == FRAME_PACKET_HEADER_SIZE
+
+FRAME_NUMBER_OFFSET = FRAME_PACKET_HEADER_DTYPE.fields['frame_number'][1]
+PACKET_LENGTH_OFFSET = FRAME_PACKET_HEADER_DTYPE.fields['length'][1]
+FRAME_ENCODING_OFFSET = FRAME_PACKET_HEADER_DTYPE.fields['version'][1]
+FRAME_ENCODING_STRUCT = struct.Struct("<BB") # version, flags
+
+# Frame encodings
+# - STANDALONE: every frame is a zlib compressed 4-bit image (older clients)
+# - DELTA: keyframes as above, delta frames are the zlib compressed XOR of
+#   the 4-bit image with the one of frame_number - 1
+FRAME_VERSION_STANDALONE = 0
+FRAME_VERSION_DELTA = 1
+
+class FrameFlags:
+    KEYFRAME = 1 << 0
+    DELTA = 1 << 1
+
+# FragmentHeader, from client to server, followed by bytes [offset, offset + size)
+# of a frame packet too large for one datagram. The magic is not a plausible
+# hp value, so fragments and whole frame packets can share the socket.
+FRAGMENT_MAGIC = 0x47415246 # "FRAG"
+FRAGMENT_MAGIC_BYTES = FRAGMENT_MAGIC.to_bytes(4, "little")
+FRAGMENT_HEADER_STRUCT = struct.Struct("<IHHQII") # magic, index, count, frame_number, total_length, offset
+assert FRAGMENT_HEADER_STRUCT.size == FRAGMENT_HEADER_SIZE
+
+# ActionPacket, from server to client
+ACTION_PACKET_DTYPE = np.dtype([
+    ('pressed_keys', 'u1', (MAX_PRESSED_KEYS, 3)),
+])
+
+NO_PORTAL_VALUE = 0xFFFF
+
+## ==================================================================
+## Key <-> Action Tables
+## ==================================================================
+
+# keyCode -> action index, -1 for keys that are not actions
+KEY_TO_ACTION_LUT = np.full(256, -1, dtype=np.int64)
+for key_code, action in KEY_TO_ACTION_MAP.items():
+    if key_code != NO_KEY_VALUE:
+        KEY_TO_ACTION_LUT[key_code] = action
+
+# plain list for the single packet path, indexing numpy scalars is slower
+KEY_TO_ACTION_LIST = KEY_TO_ACTION_LUT.tolist()
+
+ACTION_BITS = 1 << np.arange(Actions._SIZE, dtype=np.int64)
+
+def action_states_to_mask(action_states):
+    return int(np.dot(np.asarray(action_states, dtype=np.int64).reshape(-1) != 0, ACTION_BITS))
+
+def _build_action_packet(mask):
+    packet = np.zeros(1, dtype=ACTION_PACKET_DTYPE)
+    keys = [ACTION_TO_KEY_MAP[i] for i in range(Actions._SIZE) if mask & (1 << i)]
+    if keys:
+        packet['pressed_keys'][0, :len(keys)] = keys
+    return packet.tobytes()
+
+# Every possible toggle state, indexed by its action bitmask
+ACTION_PACKET_TABLE = [_build_action_packet(mask) for mask in range(1 << Actions._SIZE)]
+
+## ==================================================================
+## Frame Packet Decoding
+## ==================================================================
+
+def decode_frame_header(packet):
+    # -> (frame_number, (hp, mp, exp, mapDim, player, portals), action_state, length)
+    fields = FRAME_PACKET_HEADER_STRUCT.unpack_from(packet)
+    hp, mp, exp, map_width, map_height, player_x, player_y = fields[:7]
+    portal_x = fields[7:7 + MAX_PORTALS]
+    portal_y = fields[7 + MAX_PORTALS:7 + 2 * MAX_PORTALS]
+    frame_number, keys, length = fields[7 + 2 * MAX_PORTALS:]
+
+    portals = [(x, y) for x, y in zip(portal_x, portal_y) if x != NO_PORTAL_VALUE and y != NO_PORTAL_VALUE]
+    action_state = keys_to_action_state(keys[2::3])
+    return frame_number, (hp, mp, exp, (map_width, map_height), (player_x, player_y), portals), action_state, length
+
+def decode_frame_encoding(packet):
+    # -> (version, flags)
+    return FRAME_ENCODING_STRUCT.unpack_from(packet, FRAME_ENCODING_OFFSET)
+
+def keys_to_action_state(key_codes):
+    action_state = bytearray(Actions._SIZE)
+    for key_code in key_codes:
+        action = KEY_TO_ACTION_LIST[key_code]
+        if action >= 0:
+            action_state[action] = 1
+    return np.frombuffer(action_state, dtype=np.uint8)
+
+## ==================================================================
+## Frame Packet Encoding (simulated clients)
+## ==================================================================
+
+NO_PRESSED_KEYS = bytes(MAX_PRESSED_KEYS * 3)
+
+def encode_frame_header(frame_number, metrics, pressed_keys, length, version=FRAME_VERSION_STANDALONE, flags=0):
+    # metrics as returned by decode_frame_header, pressed_keys in ActionPacket layout (48 bytes)
+    hp, mp, exp, (map_width, map_height), (player_x, player_y), portals = metrics
+    portals = list(portals)[:MAX_PORTALS]
+    portal_x = [x for x, y in portals] + [NO_PORTAL_VALUE] * (MAX_PORTALS - len(portals))
+    portal_y = [y for x, y in portals] + [NO_PORTAL_VALUE] * (MAX_PORTALS - len(portals))
+    header = bytearray(FRAME_PACKET_HEADER_STRUCT.pack(hp, mp, exp, map_width, map_height, player_x, player_y,
+                                                       *portal_x, *portal_y, frame_number, bytes(pressed_keys), length))
+    FRAME_ENCODING_STRUCT.pack_into(header, FRAME_ENCODING_OFFSET, version, flags)
+    return bytes(header)
+
+def encode_fragments(packet, frame_number, max_datagram_size=MAX_PACKET_SIZE):
+    # whole frame packet -> datagrams, unchanged when it fits in one
+    if len(packet) <= max_datagram_size:
+        return [packet]
+    count = (len(packet) + FRAGMENT_DATA_SIZE - 1) // FRAGMENT_DATA_SIZE
+    return [FRAGMENT_HEADER_STRUCT.pack(FRAGMENT_MAGIC, index, count, frame_number, len(packet), offset)
+            + packet[offset:offset + FRAGMENT_DATA_SIZE]
+            for index, offset in enumerate(range(0, len(packet), FRAGMENT_DATA_SIZE))]
+
+## ==================================================================
+## Action Packet Encoding
+## ==================================================================
+
+def encode_action_mask(mask):
+    # mask: int with bit i set when action i is toggled on
+    return ACTION_PACKET_TABLE[mask]
@@ -0,0 +1,175 @@
+import numpy as np
+
+from model.config import FRAMES_PER_STEP, Actions, \
+    MEMORY_SIZE, REPLAY_FRAME_CAPACITY, STACK_DEDUP_CLIENTS
+from model.frame_decoder import PACKED_FRAME_SIZE, pack_8bit_to_4bit, unpack_frame_stacks
+from model.prioritized_replay import PrioritizedSampler
+
+## ==================================================================
+## Replay Memory
+## ==================================================================
+
+class ReplayMemory:
+    # Stores every frame once, 4-bit packed, in a circular frame array.
+    # Transitions only hold the ids of their frames, stacked states are
+    # rebuilt when sampling. Consecutive experiences of a client share
+    # their stacks (next state of one is the state of the next) so each
+    # transition costs FRAMES_PER_STEP packed frames, also when clients
+    # interleave: the last stack is remembered per client key.
+    # A shared stack can be older than transitions of other clients appended
+    # after it, so transitions whose frames were overwritten can sit anywhere
+    # in the ring. They are marked dead and skipped, the ring start only moves
+    # past dead or evicted transitions.
+
+    def __init__(self, capacity=MEMORY_SIZE, frame_capacity=REPLAY_FRAME_CAPACITY):
+        self.capacity = capacity
+        self.frame_capacity = frame_capacity
+        self.rng = np.random.default_rng()
+
+        # Frame storage, frame ids grow forever and wrap onto the array
+        self.frames = np.zeros((frame_capacity, PACKED_FRAME_SIZE), dtype=np.uint8)
+        self.frames_written = 0
+        self._last_stacks = {} # client key -> (stack, frame ids), least recently used first
+
+        # Transition storage
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.state_ids = np.zeros((capacity, FRAMES_PER_STEP), dtype=np.int64)
+        self.next_state_ids = np.zeros((capacity, FRAMES_PER_STEP), dtype=np.int64)
+        self.action_states = np.zeros((capacity, Actions._SIZE), dtype=np.uint8)
+        self.next_action_states = np.zeros((capacity, Actions._SIZE), dtype=np.uint8)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+        self.oldest_frame = np.zeros(capacity, dtype=np.int64) # smallest frame id of each transition
+        self.live = np.zeros(capacity, dtype=bool)
+        self.start = 0
+        self.size = 0 # slots from start to the newest transition, live or dead
+        self.live_count = 0
+        self.count = 0 # total transitions appended, also the next experience id
+
+    def __len__(self):
+        return self.live_count
+
+    ## Appending
+    ## ------------------------------------------------------------------
+
+    def append(self, state, action_states, action, reward, next_state, next_action_states, done, key=None):
+        # key: client of the experience (its addr), stacks are only shared within a client
+        state_ids = self._store_stack(state, key)
+        next_state_ids = self._store_stack(next_state, key)
+
+        # Drop transitions whose frames were overwritten, then the oldest if full
+        self._evict_stale()
+        if self.size == self.capacity:
+            self._pop_oldest()
+
+        slot = (self.start + self.size) % self.capacity
+        self.ids[slot] = self.count
+        self.state_ids[slot] = state_ids
+        self.next_state_ids[slot] = next_state_ids
+        self.action_states[slot] = np.reshape(action_states, -1)
+        self.next_action_states[slot] = np.reshape(next_action_states, -1)
+        self.actions[slot] = action
+        self.rewards[slot] = reward
+        self.dones[slot] = done
+        self.oldest_frame[slot] = min(state_ids.min(), next_state_ids.min())
+        self.live[slot] = True
+        self.live_count += 1
+        self.size += 1
+        self.count += 1
+        return slot
+
+    def _store_stack(self, stack, key):
+        # stack: (1, FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP) uint8
+        last = self._last_stacks.pop(key, None)
+        if last is not None and self._stack_ids_valid(last[1]) and np.array_equal(stack, last[0]):
+            self._last_stacks[key] = last
+            return last[1]
+
+        ids = np.arange(self.frames_written, self.frames_written + FRAMES_PER_STEP, dtype=np.int64)
+        for c in range(FRAMES_PER_STEP):
+            pack_8bit_to_4bit(stack[0, :, :, c], self.frames[ids[c] % self.frame_capacity])
+        self.frames_written += FRAMES_PER_STEP
+
+        self._last_stacks[key] = (stack, ids)
+        if len(self._last_stacks) > STACK_DEDUP_CLIENTS:
+            del self._last_stacks[next(iter(self._last_stacks))]
+        return ids
+
+    def _stack_ids_valid(self, ids):
+        # a shared stack must survive the next stack written by the same append
+        return ids.min() >= self.frames_written + FRAMES_PER_STEP - self.frame_capacity
+
+    def _evict_stale(self):
+        stale = np.flatnonzero(self.live & (self.oldest_frame < self.frames_written - self.frame_capacity))
+        if len(stale):
+            self._remove(stale)
+        while self.size > 0 and not self.live[self.start]:
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        if self.live[self.start]:
+            self._remove(np.array([self.start]))
+        self.start = (self.start + 1) % self.capacity
+        self.size -= 1
+
+    def _remove(self, slots):
+        self.live[slots] = False
+        self.live_count -= len(slots)
+
+    ## Sampling
+    ## ------------------------------------------------------------------
+
+    def sample_slots(self, batch_size):
+        return self.rng.choice(np.flatnonzero(self.live), batch_size, replace=False)
+
+    def sample(self, batch_size):
+        # -> (experience ids, (states, action_states, actions, rewards, next_states, next_action_states, dones),
+        #     importance-sampling weights, None when sampling uniformly)
+        return *self.gather(self.sample_slots(batch_size)), None
+
+    def update_priorities(self, ids, td_errors):
+        pass # uniform sampling
+
+    def gather(self, slots):
+        batch = (
+            unpack_frame_stacks(self.frames, self.state_ids[slots] % self.frame_capacity),
+            self.action_states[slots],
+            self.actions[slots],
+            self.rewards[slots],
+            unpack_frame_stacks(self.frames, self.next_state_ids[slots] % self.frame_capacity),
+            self.next_action_states[slots],
+            self.dones[slots],
+        )
+        return self.ids[slots], batch
+
+## ==================================================================
+## Prioritized Replay Memory
+## ==================================================================
+
+class PrioritizedReplayMemory(ReplayMemory):
+    # Same storage, minibatches are drawn proportionally to the TD error of
+    # each transition (see PrioritizedSampler) instead of uniformly.
+
+    def __init__(self, capacity=MEMORY_SIZE, frame_capacity=REPLAY_FRAME_CAPACITY):
+        super().__init__(capacity, frame_capacity)
+        self.sampler = PrioritizedSampler(capacity)
+
+    def append(self, state, action_states, action, reward, next_state, next_action_states, done, key=None):
+        slot = super().append(state, action_states, action, reward, next_state, next_action_states, done, key)
+        self.sampler.add(slot)
+        return slot
+
+    def _remove(self, slots):
+        self.sampler.remove(slots)
+        super()._remove(slots)
+
+    def sample(self, batch_size):
+        slots, weights = self.sampler.sample(batch_size)
+        return *self.gather(slots), weights
+
+    def update_priorities(self, ids, td_errors):
+        # slots are ids modulo capacity, skip transitions replaced since sampling
+        slots = ids % self.capacity
+        current = self.ids[slots] == ids
+        self.sampler.update(slots[current], np.asarray(td_errors)[current])
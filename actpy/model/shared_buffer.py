@@ -0,0 +1,37 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+## ==================================================================
+## Shared Memory Helpers
+## ==================================================================
+
+ALIGNMENT = 64
+
+def create_shared_memory(size, name=None):
+    return shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+
+def attach_shared_memory(name):
+    try:
+        # python 3.13+, only the creating process owns the segment
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # child processes share the creator's resource tracker, so the
+        # segment is still only unlinked once
+        return shared_memory.SharedMemory(name=name)
+
+def layout_arrays(specs):
+    # specs: [(name, shape, dtype), ...] -> ({name: offset}, total size)
+    offsets = {}
+    offset = 0
+    for name, shape, dtype in specs:
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        offsets[name] = offset
+        offset += int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+    return offsets, offset
+
+def map_arrays(buffer, specs, offsets):
+    # numpy views of each array inside the shared buffer
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offsets[name])
+        for name, shape, dtype in specs
+    }
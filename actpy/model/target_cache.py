@@ -0,0 +1,56 @@
+import numpy as np
+
+from model.config import MEMORY_SIZE
+
+## ==================================================================
+## Target Q Cache
+## ==================================================================
+
+class TargetQCache:
+    # max Q of the target network for the next state of each experience,
+    # keyed by experience id. The target network is frozen between syncs,
+    # so a value stays valid until invalidate() is called after
+    # target_model.set_weights. Invalidation bumps a version instead of
+    # clearing the arrays. Ids wrap onto `capacity` slots, a collision is a miss.
+
+    def __init__(self, capacity=MEMORY_SIZE):
+        self.capacity = capacity
+        self.keys = np.full(capacity, -1, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.version = 1
+
+        self.hits = 0
+        self.misses = 0
+        self.total_hits = 0
+        self.total_misses = 0
+
+    def invalidate(self):
+        self.version += 1
+
+    def lookup(self, ids):
+        # -> (hit mask, cached values, only meaningful where hit)
+        slots = ids % self.capacity
+        hit = (self.keys[slots] == ids) & (self.versions[slots] == self.version)
+        hits = int(np.count_nonzero(hit))
+        self.hits += hits
+        self.misses += len(ids) - hits
+        return hit, self.values[slots]
+
+    def store(self, ids, values):
+        slots = ids % self.capacity
+        self.keys[slots] = ids
+        self.versions[slots] = self.version
+        self.values[slots] = values
+
+    ## Stats
+    ## ------------------------------------------------------------------
+
+    def format_stats(self):
+        # hit rate since the last call, and overall
+        self.total_hits += self.hits
+        self.total_misses += self.misses
+        recent = self.hits / max(self.hits + self.misses, 1)
+        overall = self.total_hits / max(self.total_hits + self.total_misses, 1)
+        self.hits = self.misses = 0
+        return f"target cache hit rate: {recent * 100:.1f}% (overall {overall * 100:.1f}%)"
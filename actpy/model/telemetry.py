@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from model.config import TELEMETRY_FLUSH_INTERVAL, TELEMETRY_SUMMARY_INTERVAL, TELEMETRY_HOST, TELEMETRY_PORT
+
+## ==================================================================
+## Stage Reporter
+## ==================================================================
+
+class Telemetry:
+    # Counters and gauges of one pipeline stage. Updates are plain dict
+    # writes, a snapshot is sent to the parent at most every flush interval.
+    # Counters are cumulative, the aggregator derives the rates.
+    # Without a queue (standalone scripts) nothing is sent.
+
+    def __init__(self, stage, telemetry_queue, interval=TELEMETRY_FLUSH_INTERVAL):
+        self.stage = stage
+        self.telemetry_queue = telemetry_queue
+        self.interval = interval
+        self.counters = {}
+        self.gauges = {}
+        self.channels = [] # channels this stage puts into
+        self.last_flush_time = time.monotonic()
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_counters(self, counters):
+        # cumulative counters kept elsewhere, e.g. ingest stats
+        self.counters.update(counters)
+
+    def watch(self, *channels):
+        # report the overflows of channels written by this stage
+        self.channels += [channel for channel in channels if channel is not None]
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def maybe_flush(self):
+        # True when a snapshot was sent, to refresh expensive gauges only then
+        if time.monotonic() - self.last_flush_time < self.interval:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        self.last_flush_time = time.monotonic()
+        if self.telemetry_queue is None:
+            return
+        # cpu time of the thread running the stage loop
+        self.counters['cpu_seconds'] = time.thread_time()
+        for channel in self.channels:
+            self.counters[f"{channel.name}_overflows"] = channel.overflows
+        try:
+            self.telemetry_queue.put((self.stage, os.getpid(), dict(self.counters), dict(self.gauges)))
+        except:
+            pass
+
+## ==================================================================
+## Aggregator (parent process)
+## ==================================================================
+
+class TelemetryAggregator:
+    # Collects the stage snapshots, serves them as Prometheus text on
+    # http://TELEMETRY_HOST:port/metrics and prints a summary with per
+    # second rates every summary interval. Without a port, or when it is
+    # taken, only the console summary runs.
+
+    def __init__(self, telemetry_queue, stop_event, port=TELEMETRY_PORT):
+        self.telemetry_queue = telemetry_queue
+        self.stop_event = stop_event
+        self.stages = {} # stage -> (counters, gauges)
+        self.previous = {} # stage -> counters at the last summary
+        self.lock = threading.Lock()
+        self.last_summary_time = time.monotonic()
+
+        self.server = None
+        if port:
+            try:
+                self.server = ThreadingHTTPServer((TELEMETRY_HOST, port), self._make_handler())
+                self.server.daemon_threads = True
+            except OSError as e:
+                print(f"Telemetry endpoint disabled, cannot listen on {TELEMETRY_HOST}:{port}: {e}")
+        self.thread = threading.Thread(target=self._collect_loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        if self.server is not None:
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Telemetry on http://{TELEMETRY_HOST}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _collect_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                stage, pid, counters, gauges = self.telemetry_queue.get(timeout=1)
+                with self.lock:
+                    self.stages[stage] = (counters, gauges)
+            except:
+                pass
+
+            if time.monotonic() - self.last_summary_time >= TELEMETRY_SUMMARY_INTERVAL:
+                self.print_summary()
+
+    ## Console Summary
+    ## ------------------------------------------------------------------
+
+    def print_summary(self):
+        now = time.monotonic()
+        elapsed = now - self.last_summary_time
+        self.last_summary_time = now
+
+        with self.lock:
+            stages = dict(self.stages)
+        print(f"Telemetry over the last {elapsed:.0f} s:")
+        for stage, (counters, gauges) in sorted(stages.items()):
+            previous = self.previous.get(stage, {})
+            rates = [f"{name} {(value - previous.get(name, 0)) / elapsed:.1f}/s"
+                     for name, value in counters.items() if name != 'cpu_seconds']
+            cpu = (counters.get('cpu_seconds', 0) - previous.get('cpu_seconds', 0)) / elapsed * 100
+            values = [f"{name} {_format_value(value)}" for name, value in gauges.items()]
+            print(f"  {stage:>16}: cpu {cpu:.0f}%  " + "  ".join(rates + values))
+            self.previous[stage] = counters
+
+    ## Prometheus Endpoint
+    ## ------------------------------------------------------------------
+
+    def render_metrics(self):
+        with self.lock:
+            stages = dict(self.stages)
+
+        # group samples by metric name, as the text format expects
+        metrics = {}
+        for stage, (counters, gauges) in stages.items():
+            for name, value in counters.items():
+                metrics.setdefault((f"actpy_{name}_total", "counter"), []).append((stage, value))
+            for name, value in gauges.items():
+                metrics.setdefault((f"actpy_{name}", "gauge"), []).append((stage, value))
+
+        lines = []
+        for (name, kind), samples in sorted(metrics.items()):
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, value in samples:
+                lines.append(f'{name}{{stage="{stage}"}} {float(value)}')
+        return "\n".join(lines) + "\n"
+
+    def _make_handler(self):
+        aggregator = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = aggregator.render_metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # no console line per scrape
+
+        return MetricsHandler
+
+def _format_value(value):
+    return f"{value:.3g}" if isinstance(value, float) else str(value)
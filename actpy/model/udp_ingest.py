@@ -0,0 +1,267 @@
+import time
+import queue
+import select
+import socket
+import threading
+from struct import unpack_from
+
+from model.config import FRAME_PACKET_HEADER_SIZE, MAX_PACKET_SIZE, MAX_FRAME_PACKET_SIZE, FRAGMENT_HEADER_SIZE, \
+    INGEST_RECV_BUFFER_SIZE, INGEST_BATCH_SIZE, INGEST_QUEUE_SIZE, INGEST_CLIENT_TIMEOUT, \
+    JITTER_BUFFER_DEPTH, JITTER_BUFFER_MAX_DELAY, JITTER_BUFFER_RESET_GAP, REASSEMBLY_SLOTS, REASSEMBLY_TIMEOUT
+from model.latency_trace import trace_clock
+from model.protocol import FRAME_NUMBER_OFFSET, PACKET_LENGTH_OFFSET, FRAGMENT_MAGIC, FRAGMENT_MAGIC_BYTES, \
+    FRAGMENT_HEADER_STRUCT
+
+## ==================================================================
+## Jitter Buffer
+## ==================================================================
+
+class JitterBuffer:
+    # Reorders the packets of one client by frame number. A missing frame
+    # is waited for until the buffer holds `depth` newer frames or the
+    # oldest pending frame waited `max_delay` seconds, then it counts as lost.
+
+    def __init__(self, stats, depth=JITTER_BUFFER_DEPTH, max_delay=JITTER_BUFFER_MAX_DELAY):
+        self.stats = stats
+        self.depth = depth
+        self.max_delay = max_delay
+        self.pending = {} # frame_number -> (arrival time, packet)
+        self.next_frame = None
+        self.newest_frame = None
+        self.stale_streak = 0 # stale frames in a row
+        self.last_push_time = None
+
+    def push(self, frame_number, packet, now):
+        self.last_push_time = now
+
+        # client restarted, start over from its new frame numbers: they dropped
+        # far behind, back to the first frames, or every frame is stale for longer
+        # than a late frame can be (a restart that fell between both checks)
+        if self.next_frame is not None and frame_number < self.next_frame and (
+                self.next_frame - frame_number > JITTER_BUFFER_RESET_GAP
+                or frame_number <= self.depth
+                or self.stale_streak >= self.depth):
+            self.pending.clear()
+            self.next_frame = None
+            self.newest_frame = None
+
+        if self.next_frame is not None and frame_number < self.next_frame:
+            self.stats['stale'] += 1
+            self.stale_streak += 1
+            return
+        self.stale_streak = 0
+        if frame_number in self.pending:
+            self.stats['duplicates'] += 1
+            return
+        if self.newest_frame is not None and frame_number < self.newest_frame:
+            self.stats['reordered'] += 1
+        else:
+            self.newest_frame = frame_number
+        self.pending[frame_number] = (now, packet)
+
+    def pop_ready(self, now):
+        ready = []
+        while self.pending:
+            if self.next_frame is None:
+                self.next_frame = min(self.pending)
+
+            if self.next_frame in self.pending:
+                ready.append(self.pending.pop(self.next_frame)[1])
+                self.next_frame += 1
+                continue
+
+            # give up on the missing frame once the buffer is full or it waited too long
+            oldest = min(self.pending)
+            if len(self.pending) >= self.depth or now - self.pending[oldest][0] >= self.max_delay:
+                self.stats['lost'] += oldest - self.next_frame
+                self.next_frame = oldest
+                continue
+            break
+        return ready
+
+## ==================================================================
+## Fragment Reassembly
+## ==================================================================
+
+class PartialFrame:
+    __slots__ = ('slot', 'first_time', 'count', 'total_length', 'received', 'received_count')
+
+    def __init__(self, slot, first_time, count, total_length):
+        self.slot = slot
+        self.first_time = first_time
+        self.count = count
+        self.total_length = total_length
+        self.received = bytearray(count) # 1 per fragment already copied
+        self.received_count = 0
+
+class FragmentReassembler:
+    # Copies the fragments of frame packets too large for one datagram into
+    # a fixed pool of preallocated buffers, one per frame in flight. A frame
+    # still missing fragments after `timeout` seconds is discarded, so is the
+    # oldest one when every slot is taken. A complete frame is copied out once,
+    # the slot is reused while the frame waits in the jitter buffer.
+
+    def __init__(self, stats, slots=REASSEMBLY_SLOTS, timeout=REASSEMBLY_TIMEOUT):
+        self.stats = stats
+        self.timeout = timeout
+        self.buffers = [bytearray(MAX_FRAME_PACKET_SIZE) for _ in range(slots)]
+        self.free_slots = list(range(slots))
+        self.frames = {} # (addr, frame_number) -> PartialFrame, in arrival order
+        self.completed = {} # recently completed keys, late duplicates must not start a new frame
+        self.completed_capacity = 4 * slots
+
+    def push(self, packet, addr, now):
+        # -> the complete frame packet once its last fragment arrived, else None
+        self.stats['fragments'] += 1
+        if len(packet) < FRAGMENT_HEADER_SIZE:
+            self.stats['fragment_errors'] += 1
+            return None
+        magic, index, count, frame_number, total_length, offset = FRAGMENT_HEADER_STRUCT.unpack_from(packet)
+        size = len(packet) - FRAGMENT_HEADER_SIZE
+        if magic != FRAGMENT_MAGIC or index >= count or total_length > MAX_FRAME_PACKET_SIZE \
+                or offset + size > total_length:
+            self.stats['fragment_errors'] += 1
+            return None
+
+        key = (addr, frame_number)
+        if key in self.completed:
+            self.stats['fragment_duplicates'] += 1
+            return None
+        frame = self.frames.get(key)
+        if frame is None:
+            if not self.free_slots:
+                self._discard(next(iter(self.frames)))
+            frame = self.frames[key] = PartialFrame(self.free_slots.pop(), now, count, total_length)
+        elif frame.count != count or frame.total_length != total_length:
+            self.stats['fragment_errors'] += 1
+            return None
+
+        if frame.received[index]:
+            self.stats['fragment_duplicates'] += 1
+            return None
+        buffer = self.buffers[frame.slot]
+        buffer[offset:offset + size] = memoryview(packet)[FRAGMENT_HEADER_SIZE:]
+        frame.received[index] = 1
+        frame.received_count += 1
+        if frame.received_count < frame.count:
+            return None
+
+        del self.frames[key]
+        self.free_slots.append(frame.slot)
+        self.completed[key] = None
+        if len(self.completed) > self.completed_capacity:
+            del self.completed[next(iter(self.completed))]
+        self.stats['reassembled'] += 1
+        return bytes(memoryview(buffer)[:frame.total_length])
+
+    def expire(self, now):
+        # frames are in arrival order, stop at the first one still in time
+        while self.frames:
+            key = next(iter(self.frames))
+            if now - self.frames[key].first_time < self.timeout:
+                break
+            self._discard(key)
+
+    def _discard(self, key):
+        frame = self.frames.pop(key)
+        self.free_slots.append(frame.slot)
+        self.stats['reassembly_timeouts'] += 1
+        self.stats['fragments_lost'] += frame.count - frame.received_count
+
+## ==================================================================
+## UDP Ingest
+## ==================================================================
+
+class UdpIngest:
+    # Dedicated receiver thread: drains the socket in batches, validates
+    # packets and releases them in frame order through a bounded queue.
+    # The receiver never blocks on the consumer, when the queue is full
+    # the packet is dropped and counted. Fragmented frame packets are
+    # reassembled first. With a recorder, every datagram is logged as
+    # received, before validation. A client silent for INGEST_CLIENT_TIMEOUT
+    # is forgotten, restarted clients usually come back on a new port.
+
+    def __init__(self, sock, stop_event, recorder=None):
+        self.sock = sock
+        self.stop_event = stop_event
+        self.recorder = recorder # PacketLogWriter, owned by the receiver thread
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, INGEST_RECV_BUFFER_SIZE)
+
+        self.packets = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.jitter_buffers = {} # addr -> JitterBuffer
+        self.expired = queue.Queue() # addrs forgotten by the ingest, for the consumer's own per client state
+        self.stats = {
+            'received': 0, 'released': 0, 'truncated': 0, 'stale': 0, 'duplicates': 0,
+            'reordered': 0, 'lost': 0, 'overflow': 0, 'decode_errors': 0,
+            'fragments': 0, 'fragment_duplicates': 0, 'fragment_errors': 0, 'reassembled': 0,
+            'reassembly_timeouts': 0, 'fragments_lost': 0,
+        }
+        self.reassembler = FragmentReassembler(self.stats)
+        self.thread = threading.Thread(target=self._receive_loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def get(self, timeout=None):
+        # -> (addr, packet, receive time) in frame order, raises queue.Empty on timeout
+        return self.packets.get(timeout=timeout)
+
+    def _receive_loop(self):
+        poll_interval = JITTER_BUFFER_MAX_DELAY / 2
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.sock], [], [], poll_interval)
+            now = time.monotonic()
+
+            # drain everything that is already waiting, without blocking
+            received = 0
+            while readable and received < INGEST_BATCH_SIZE:
+                try:
+                    packet, addr = self.sock.recvfrom(MAX_PACKET_SIZE)
+                except OSError:
+                    break
+                received += 1
+                self._push(packet, addr, now)
+                readable, _, _ = select.select([self.sock], [], [], 0)
+
+            self._release(now)
+
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _push(self, packet, addr, now):
+        self.stats['received'] += 1
+        if self.recorder is not None:
+            self.recorder.append(packet, addr, now)
+        if packet[:4] == FRAGMENT_MAGIC_BYTES:
+            packet = self.reassembler.push(packet, addr, now)
+            if packet is None:
+                return
+        if len(packet) < FRAME_PACKET_HEADER_SIZE \
+                or len(packet) - FRAME_PACKET_HEADER_SIZE < unpack_from("<Q", packet, PACKET_LENGTH_OFFSET)[0]:
+            self.stats['truncated'] += 1
+            return
+
+        frame_number = unpack_from("<Q", packet, FRAME_NUMBER_OFFSET)[0]
+        if addr not in self.jitter_buffers:
+            self.jitter_buffers[addr] = JitterBuffer(self.stats)
+        self.jitter_buffers[addr].push(frame_number, (packet, trace_clock()), now)
+
+    def _release(self, now):
+        self.reassembler.expire(now)
+        expired = []
+        for addr, jitter_buffer in self.jitter_buffers.items():
+            for packet, received_time in jitter_buffer.pop_ready(now):
+                try:
+                    self.packets.put_nowait((addr, packet, received_time))
+                    self.stats['released'] += 1
+                except queue.Full:
+                    self.stats['overflow'] += 1
+            if not jitter_buffer.pending and now - jitter_buffer.last_push_time > INGEST_CLIENT_TIMEOUT:
+                expired.append(addr)
+
+        for addr in expired:
+            del self.jitter_buffers[addr]
+            self.expired.put(addr)
+
+    def format_stats(self):
+        return ", ".join(f"{name}: {value}" for name, value in self.stats.items())
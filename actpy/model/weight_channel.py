@@ -0,0 +1,107 @@
+import os
+import uuid
+import numpy as np
+
+from model.shared_buffer import create_shared_memory, attach_shared_memory, layout_arrays, map_arrays
+
+## ==================================================================
+## Weight Channel
+## ==================================================================
+
+def _channel_specs(weights):
+    specs = [('version', (1,), np.uint64)] # even when stable, odd while the publisher writes
+    specs += [(f"w{i}", w.shape, w.dtype) for i, w in enumerate(weights)]
+    return specs
+
+class WeightChannel:
+    # Publishes model weights from one trainer to any number of collectors
+    # through a shared-memory parameter buffer guarded by a version counter
+    # (seqlock). The trainer creates the buffer on its first publish,
+    # collectors attach lazily by name and only copy when the version moved.
+    # Both sides derive the layout from their own model, so the
+    # architectures must match.
+
+    def __init__(self, name=None):
+        self.name = name if name is not None else f"actpy_weights_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self.shm = None
+        self.owner = False
+        self.version = None
+        self.arrays = None
+
+        # Subscriber state, local to each process
+        self.local_weights = None
+        self.last_version = 0
+        self.torn_reads = 0
+
+    # Processes receive an unattached channel with the same name
+    def __getstate__(self):
+        return self.name
+
+    def __setstate__(self, name):
+        self.__init__(name)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.version = self.arrays = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+    def _map(self, weights):
+        specs = _channel_specs(weights)
+        offsets, size = layout_arrays(specs)
+        if self.shm is None:
+            self.shm = create_shared_memory(size, self.name)
+            self.owner = True
+        if self.shm.size < size:
+            raise Exception(f"Weight channel {self.name} holds {self.shm.size} bytes, the model needs {size}")
+        arrays = map_arrays(self.shm.buf, specs, offsets)
+        self.version = arrays.pop('version')
+        self.arrays = [arrays[f"w{i}"] for i in range(len(weights))]
+
+    ## Publisher
+    ## ------------------------------------------------------------------
+
+    def publish(self, weights):
+        if self.shm is None:
+            self._map(weights)
+            self.version[0] = 0
+
+        version = int(self.version[0])
+        self.version[0] = version + 1
+        for array, w in zip(self.arrays, weights):
+            np.copyto(array, w)
+        self.version[0] = version + 2
+
+    ## Subscriber
+    ## ------------------------------------------------------------------
+
+    def poll(self, model):
+        # installs the latest published weights into the model, returns True when it did
+        if self.local_weights is None:
+            self.local_weights = [np.empty_like(w) for w in model.get_weights()]
+
+        if self.shm is None:
+            try:
+                self.shm = attach_shared_memory(self.name)
+            except FileNotFoundError:
+                return False # nothing published yet
+            self._map(self.local_weights)
+
+        version = int(self.version[0])
+        if version == self.last_version or version % 2 == 1:
+            return False
+
+        for local, array in zip(self.local_weights, self.arrays):
+            np.copyto(local, array)
+
+        # the publisher wrote while we copied, retry on the next poll
+        if int(self.version[0]) != version:
+            self.torn_reads += 1
+            return False
+
+        self.last_version = version
+        model.set_weights(self.local_weights)
+        return True
@@ -0,0 +1,93 @@
+import time
+import socket
+import argparse
+import numpy as np
+
+from model.config import PORT, PACKET_LOG_DIR
+from model.packet_log import PacketLogReader
+
+## ==================================================================
+## Replayer
+## ==================================================================
+
+def replay(log, server, speed, loss, reorder, rng):
+    # Resends the log with its original timing divided by `speed`, as fast
+    # as possible when speed is 0. Each recorded source gets its own socket
+    # so the server sees the same number of clients. A reordered packet is
+    # held back and sent right after the next one.
+    sockets = {} # recorded (host, port) -> socket
+    stats = {'sent': 0, 'bytes': 0, 'dropped': 0, 'reordered': 0, 'max_late': 0.0}
+    held = None # (socket, packet) waiting to be sent after the next packet
+
+    def send(sock, packet):
+        sock.sendto(packet, server)
+        stats['sent'] += 1
+        stats['bytes'] += len(packet)
+
+    first_arrival = log.read(0)[0] if len(log) else 0.0
+    start = time.perf_counter()
+    for index in range(len(log)):
+        arrival, addr, packet = log.read(index)
+
+        if speed > 0:
+            delay = start + (arrival - first_arrival) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                stats['max_late'] = max(stats['max_late'], -delay)
+
+        if addr not in sockets:
+            sockets[addr] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock = sockets[addr]
+
+        if rng.random() < loss:
+            stats['dropped'] += 1
+            continue
+        if held is None and rng.random() < reorder:
+            held = (sock, packet)
+            stats['reordered'] += 1
+            continue
+
+        send(sock, packet)
+        if held is not None:
+            send(*held)
+            held = None
+
+    if held is not None:
+        send(*held)
+    elapsed = time.perf_counter() - start
+
+    for sock in sockets.values():
+        sock.close()
+    return stats, elapsed, len(sockets)
+
+## ==================================================================
+## Main
+## ==================================================================
+
+def main(args):
+    log = PacketLogReader(args.log)
+    if len(log) == 0:
+        raise Exception(f"No packets in {args.log}")
+    print(f"Replaying {len(log)} packets ({log.header['bytes'] / 1e6:.1f} MB, {log.duration():.1f} s recorded) "
+          f"to {args.host}:{args.port} at {'max speed' if args.speed == 0 else f'{args.speed}x'}")
+
+    rng = np.random.default_rng(args.seed)
+    stats, elapsed, clients = replay(log, (args.host, args.port), args.speed, args.loss, args.reorder, rng)
+
+    print(f"Clients: {clients}, {elapsed:.2f} s")
+    print(f"Sent: {stats['sent']} packets, {stats['sent'] / elapsed:.1f} pps, {stats['bytes'] / elapsed / 1e6:.2f} MB/s")
+    print(f"Injected: {stats['dropped']} dropped, {stats['reordered']} reordered")
+    if args.speed > 0:
+        print(f"Max lateness behind the recorded schedule: {stats['max_late'] * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resend a recorded packet log to the server")
+    parser.add_argument("log", nargs="?", default=PACKET_LOG_DIR, help="packet log recorded with server.py --record")
+    parser.add_argument("--host", default="127.0.0.1", help="server address")
+    parser.add_argument("--port", type=int, default=PORT, help="server port")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--loss", type=float, default=0, help="probability of dropping a packet")
+    parser.add_argument("--reorder", type=float, default=0, help="probability of swapping a packet with the next one")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the loss and reorder injection")
+    main(parser.parse_args())
@@ -1,18 +1,19 @@
+import time
 import socket
+import argparse
+import importlib
 import threading
 from pynput import keyboard
 from multiprocessing import Manager, Process
 
-from model.config import PORT
+from model.config import PORT, TELEMETRY_PORT, INPUT_KEYS_QUEUE_SIZE, ACTION_QUEUE_SIZE, DISPLAY_QUEUE_SIZE, \
+    EXPERIENCE_QUEUE_SIZE, TELEMETRY_QUEUE_SIZE
+from model.channel import Channel, Overflow, message_addr
+from model.frame_ring import FrameRing
+from model.weight_channel import WeightChannel
+from model.telemetry import TelemetryAggregator
 
-## Processes and Threads
-from model.debug_display import display_entry
-from model.frame_reader import frame_reader_entry
-from model.game_actor import game_actor_entry
-from model.model_collector import model_collector_entry
-from model.model_trainer import model_trainer_entry
-from model.model_experience_dump import model_experience_dump_entry
-from model.manual_control import manual_control_entry
+MODES = ["manual", "collect", "train", "collect+train", "dump"]
 
 ## ==================================================================
 ## Keyboard Stop Condition (press ESC to stop)
@@ -42,11 +43,50 @@ def start_keyboard_listener(stop_event, input_keys_queue):
         listener.join()
 
 
+## ==================================================================
+## Lazy Entries
+## ==================================================================
+
+# Entry modules are imported where they run, so a mode only pays for the
+# modules it uses (the trainer is the only one that loads TensorFlow)
+def _load_entry(module_name, function_name):
+    start = time.perf_counter()
+    entry = getattr(importlib.import_module(module_name), function_name)
+    print(f"Startup: imported {module_name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return entry
+
+def _run_entry(module_name, function_name, *args):
+    _load_entry(module_name, function_name)(*args)
+
+def _start_process(module_name, function_name, *args):
+    process = Process(target=_run_entry, args=(module_name, function_name, *args))
+    process.start()
+    return process
+
+class StartupTimer:
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+
+    def phase(self, name):
+        now = time.perf_counter()
+        print(f"Startup: {name} in {(now - self.last) * 1000:.0f} ms")
+        self.last = now
+
+    def total(self):
+        print(f"Startup: ready in {(time.perf_counter() - self.start) * 1000:.0f} ms")
+
 ## ==================================================================
 ## Main Processes
 ## ==================================================================
 
-def main():
+def main(mode, record_path=None, telemetry_port=TELEMETRY_PORT):
+    timer = StartupTimer()
+
+    # Offline training from the experience store, no game connection
+    if mode == "train":
+        _load_entry("train_from_file", "model_trainer_entry_from_file")()
+        return
+
     # Initialize the socket connection
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -55,50 +95,62 @@ def main():
     # Initialize shared variables
     manager = Manager()
     stop_event = manager.Event() # signal to stop all threads and processes
-    input_keys_queue = manager.Queue()
-    frame_queue = manager.Queue()
-    action_queue = manager.Queue()
-    display_queue = manager.Queue()
-    experience_queue = manager.Queue()
-    weights_queue = manager.Queue()
+    input_keys_queue = Channel(manager, "input_keys", INPUT_KEYS_QUEUE_SIZE, Overflow.BLOCK, stop_event=stop_event)
+    frame_ring = FrameRing() # decoded frames are shared through shared memory
+    action_queue = Channel(manager, "action", ACTION_QUEUE_SIZE, Overflow.COALESCE, key=message_addr)
+    display_queue = Channel(manager, "display", DISPLAY_QUEUE_SIZE, Overflow.DROP_OLDEST)
+    experience_queue = Channel(manager, "experience", EXPERIENCE_QUEUE_SIZE, Overflow.BLOCK, stop_event=stop_event) \
+        if mode in ("collect+train", "dump") else None
+    weight_channel = WeightChannel() # model weights are shared through shared memory
+    telemetry_queue = Channel(manager, "telemetry", TELEMETRY_QUEUE_SIZE, Overflow.DROP_OLDEST) # stage snapshots, aggregated here
+    timer.phase("shared state")
 
     # ------------------------------------------------------------------
 
+    # Telemetry endpoint and console summary
+    telemetry = TelemetryAggregator(telemetry_queue, stop_event, telemetry_port)
+    telemetry.start()
+
     # Keyboard thread to stop the program
     keyboard_thread = threading.Thread(target=start_keyboard_listener, args=(stop_event, input_keys_queue))
     keyboard_thread.start()
 
     # Frame reader collects frames from the game and puts them in the queue
     # - Updates the display with frames
-    frame_reader = threading.Thread(target=frame_reader_entry, args=(s, stop_event, frame_queue))
+    frame_reader = threading.Thread(target=_load_entry("model.frame_reader", "frame_reader_entry"), args=(s, stop_event, frame_ring, telemetry_queue, record_path))
     frame_reader.start()
 
     # Game actor takes actions from the queue and sends them to the game
     # - Updates the display with actions
-    game_actor = threading.Thread(target=game_actor_entry, args=(s, stop_event, action_queue))
+    game_actor = threading.Thread(target=_load_entry("model.game_actor", "game_actor_entry"), args=(s, stop_event, action_queue, telemetry_queue))
     game_actor.start()
+    timer.phase("network threads")
+
+    processes = []
 
     # Debug display
-    display_process = Process(target=display_entry, args=(stop_event, display_queue))
-    display_process.start()
+    processes.append(_start_process("model.debug_display", "display_entry", stop_event, display_queue, telemetry_queue))
 
-    # Manual control of the game
-    manual_control = Process(target=manual_control_entry, args=(stop_event, frame_queue, action_queue, display_queue, input_keys_queue))
-    manual_control.start()
+    if mode == "manual":
+        # Manual control of the game
+        processes.append(_start_process("model.manual_control", "manual_control_entry",
+                                        stop_event, frame_ring, action_queue, display_queue, input_keys_queue, telemetry_queue))
+    else:
+        # Model collector processes the frames to get experience and puts actions in the queue
+        # - Every now and then also updates the model weights from the trainer
+        processes.append(_start_process("model.model_collector", "model_collector_entry",
+                                        stop_event, frame_ring, action_queue, experience_queue, weight_channel, display_queue, telemetry_queue))
 
-    # # Model collector processes the frames to get experience and puts actions in the queue
-    # # - Every now and then also updates the model weights from the trainer
-    # model_collector = Process(target=model_collector_entry, args=(
-    #     stop_event, frame_queue, action_queue, experience_queue, weights_queue, display_queue))
-    # model_collector.start()
+    if mode == "collect+train":
+        # Model trainer learns from the collected experience and publishes weights to the collector
+        processes.append(_start_process("model.model_trainer", "model_trainer_entry", stop_event, experience_queue, weight_channel, telemetry_queue))
 
-    # # Model trainer updates the model weights from the collector, and signals the collector to update weights
-    # model_trainer = Process(target=model_trainer_entry, args=(stop_event, experience_queue, weights_queue))
-    # model_trainer.start()
+    if mode == "dump":
+        # Model experience dump saves the experience to disk
+        processes.append(_start_process("model.model_experience_dump", "model_experience_dump_entry", stop_event, experience_queue, telemetry_queue))
 
-    # # Model experience dump saves the experience to disk
-    # model_trainer = Process(target=model_experience_dump_entry, args=(stop_event, experience_queue))
-    # model_trainer.start()
+    timer.phase("processes")
+    timer.total()
 
     # ------------------------------------------------------------------
 
@@ -106,14 +158,23 @@ def main():
     keyboard_thread.join()
     frame_reader.join()
     game_actor.join()
-    display_process.join()
-    manual_control.join()
-    # model_collector.join()
-    # model_trainer.join()
+    for process in processes:
+        process.join()
+    telemetry.stop()
 
     # Close the connection
     s.close()
+    frame_ring.close()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Game server")
+    parser.add_argument("--mode", choices=MODES, default="manual",
+                        help="manual: play with the keyboard, collect: model plays, "
+                             "collect+train: model plays and learns online, dump: model plays and records experiences, "
+                             "train: learn offline from recorded experiences")
+    parser.add_argument("--record", metavar="PATH", help="also record the received packets to PATH, for replay_packets.py")
+    parser.add_argument("--telemetry-port", type=int, default=TELEMETRY_PORT,
+                        help="port of the Prometheus /metrics endpoint, 0 to disable it")
+    args = parser.parse_args()
+    main(args.mode, args.record, args.telemetry_port)
@@ -0,0 +1,194 @@
+import os
+import time
+import zlib
+import socket
+import argparse
+import threading
+import numpy as np
+from multiprocessing import Pool
+
+from model.config import PORT, FRAME_WIDTH, FRAME_HEIGHT, CAPTURE_TARGET_FPS, MAX_FRAME_DATA_SIZE, MAX_PACKET_SIZE
+from model.frame_decoder import pack_8bit_to_4bit, PACKED_FRAME_SIZE
+from model.protocol import ACTION_PACKET_DTYPE, NO_PRESSED_KEYS, FRAME_VERSION_STANDALONE, FRAME_VERSION_DELTA, \
+    FrameFlags, encode_frame_header, encode_fragments
+
+# Still images at the repository root
+REPOSITORY_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_IMAGES = [os.path.join(REPOSITORY_ROOT, name) for name in ("sample.png", "screenshot.png", "capturedImage.bmp")]
+
+## ==================================================================
+## Frame Sources
+## ==================================================================
+
+def load_image_frames(paths):
+    # -> [(packed frame, metrics)], grayscale, resized to the capture resolution
+    from PIL import Image
+
+    frames = []
+    for path in paths:
+        image = Image.open(path).convert('L').resize((FRAME_WIDTH, FRAME_HEIGHT), Image.BILINEAR)
+        packed = pack_8bit_to_4bit(np.asarray(image, dtype=np.uint8), np.zeros(PACKED_FRAME_SIZE, dtype=np.uint8))
+        frames.append((packed, (1.0, 1.0, 0.0, (0, 0), (0, 0), [])))
+    return frames
+
+def load_recorded_frames(path, limit):
+    # -> [(packed frame, metrics)] from an experience store, frames are stored 4-bit packed
+    from model.experience_store import ExperienceReader
+
+    reader = ExperienceReader(path)
+    if len(reader) == 0:
+        raise Exception(f"No experiences in {path}")
+    frames = []
+    for index in range(min(len(reader), limit)):
+        # the newest frame of each next state, with the metrics recorded for it
+        frame_id = reader.columns["next_state_ids"][index][-1]
+        hp, mp, exp = (float(v) for v in reader.columns["metrics"][index])
+        frames.append((np.array(reader.columns["frames"][frame_id]), (hp, mp, exp, (0, 0), (0, 0), [])))
+    return frames
+
+def _compress(packed):
+    # same as the capture client: zlib over the 4-bit packed frame, None when it does not fit
+    data = zlib.compress(packed.tobytes())
+    return data if len(data) <= MAX_FRAME_DATA_SIZE else None
+
+def encode_frames(frames, delta):
+    # -> [(keyframe data, delta data or None, metrics)], the frames are sent in a
+    # loop so the delta of frame i is against frame i - 1, wrapping around
+    encoded = []
+    for i, (packed, metrics) in enumerate(frames):
+        data = _compress(packed)
+        if data is None:
+            raise Exception(f"Compressed frame {i} is larger than {MAX_FRAME_DATA_SIZE} bytes")
+        delta_data = _compress(packed ^ frames[i - 1][0]) if delta else None
+        encoded.append((data, delta_data, metrics))
+    return encoded
+
+## ==================================================================
+## Simulated Client
+## ==================================================================
+
+def run_client(client_index, host, port, fps, duration, frames, keyframe_interval, max_datagram_size):
+    # Sends frames at `fps`, applies the received actions to the pressed keys
+    # of the next frames like the capture client, and times each action
+    # against the last frame sent before it (approximate round trip).
+    # With a keyframe interval, frames in between are sent as deltas.
+    # Frame packets larger than `max_datagram_size` are sent as fragments.
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', 0))
+    sock.settimeout(0.1)
+    server = (host, port)
+
+    state = {'pressed_keys': NO_PRESSED_KEYS, 'last_send_time': None}
+    round_trips = []
+    stop = threading.Event()
+
+    def receive_loop():
+        while not stop.is_set():
+            try:
+                packet = sock.recv(ACTION_PACKET_DTYPE.itemsize)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(packet) != ACTION_PACKET_DTYPE.itemsize:
+                continue
+            if state['last_send_time'] is not None:
+                round_trips.append(time.perf_counter() - state['last_send_time'])
+            state['pressed_keys'] = packet
+
+    receiver = threading.Thread(target=receive_loop, daemon=True)
+    receiver.start()
+
+    version = FRAME_VERSION_DELTA if keyframe_interval > 0 else FRAME_VERSION_STANDALONE
+    frame_interval = 1 / fps
+    start = time.perf_counter()
+    sent = 0
+    sent_bytes = 0
+    frames_since_keyframe = keyframe_interval # start with a keyframe
+    while True:
+        # keep the schedule, late frames are sent right away
+        next_time = start + sent * frame_interval
+        now = time.perf_counter()
+        if next_time - start >= duration:
+            break
+        if next_time > now:
+            time.sleep(next_time - now)
+
+        data, delta_data, metrics = frames[(sent + client_index) % len(frames)]
+        flags = 0
+        if version == FRAME_VERSION_DELTA:
+            if frames_since_keyframe < keyframe_interval and delta_data is not None:
+                data, flags = delta_data, FrameFlags.DELTA
+                frames_since_keyframe += 1
+            else:
+                flags = FrameFlags.KEYFRAME
+                frames_since_keyframe = 1
+        packet = encode_frame_header(sent + 1, metrics, state['pressed_keys'], len(data), version, flags) + data
+        for datagram in encode_fragments(packet, sent + 1, max_datagram_size):
+            sock.sendto(datagram, server)
+            sent_bytes += len(datagram)
+        state['last_send_time'] = time.perf_counter()
+        sent += 1
+
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5) # late actions
+    stop.set()
+    receiver.join()
+    sock.close()
+    return {'sent': sent, 'bytes': sent_bytes, 'elapsed': elapsed, 'round_trips': round_trips}
+
+## ==================================================================
+## Report
+## ==================================================================
+
+def print_report(results, fps):
+    sent = sum(r['sent'] for r in results)
+    sent_bytes = sum(r['bytes'] for r in results)
+    elapsed = max(r['elapsed'] for r in results)
+    round_trips = np.concatenate([r['round_trips'] for r in results] + [np.zeros(0)])
+
+    print(f"Clients: {len(results)} at {fps} FPS, {elapsed:.1f} s")
+    print(f"Sent: {sent} frames, {sent / elapsed:.1f} fps ({len(results) * fps} target), "
+          f"{sent_bytes / elapsed / 1e6:.2f} MB/s")
+    if len(round_trips) == 0:
+        print("Actions: none received")
+        return
+    p50, p95, p99 = np.percentile(round_trips, [50, 95, 99]) * 1000
+    print(f"Actions: {len(round_trips)} received, {len(round_trips) / elapsed:.1f}/s")
+    print(f"Action round trip (ms, from the last frame sent): p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}")
+
+def main(args):
+    if args.store:
+        frames = load_recorded_frames(args.store, args.max_frames)
+        source = f"experience store {args.store}"
+    else:
+        frames = load_image_frames(args.images)
+        source = ", ".join(os.path.basename(path) for path in args.images)
+    frames = encode_frames(frames, args.keyframe_interval > 0)
+    print(f"Loaded {len(frames)} frames from {source}, "
+          f"{np.mean([len(data) for data, _, _ in frames]):.0f} bytes compressed on average")
+    if args.keyframe_interval > 0:
+        deltas = [len(delta_data) for _, delta_data, _ in frames if delta_data is not None]
+        print(f"Deltas: {np.mean(deltas or [0]):.0f} bytes compressed on average, keyframe every {args.keyframe_interval} frames")
+
+    client_args = [(i, args.host, args.port, args.fps, args.duration, frames, args.keyframe_interval, args.max_datagram_size)
+                   for i in range(args.clients)]
+    with Pool(args.clients) as pool:
+        results = pool.starmap(run_client, client_args)
+    print_report(results, args.fps)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated capture clients for load testing the server")
+    parser.add_argument("--host", default="127.0.0.1", help="server address")
+    parser.add_argument("--port", type=int, default=PORT, help="server port")
+    parser.add_argument("--clients", type=int, default=1, help="simultaneous clients, one process each")
+    parser.add_argument("--fps", type=float, default=CAPTURE_TARGET_FPS, help="frames per second per client")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--images", nargs="+", default=DEFAULT_IMAGES, help="still images to cycle through")
+    parser.add_argument("--store", help="experience store to replay frames from, instead of images")
+    parser.add_argument("--keyframe-interval", type=int, default=0,
+                        help="send deltas with a keyframe every N frames, 0 for standalone frames")
+    parser.add_argument("--max-datagram-size", type=int, default=MAX_PACKET_SIZE,
+                        help="frame packets larger than this are sent as fragments")
+    parser.add_argument("--max-frames", type=int, default=1000, help="frames loaded from the experience store")
+    main(parser.parse_args())
@@ -1,67 +1,63 @@
-import os
-import random
+import argparse
 import numpy as np
-from collections import deque
-from struct import unpack, calcsize
 
-from model.config import FRAME_WIDTH, FRAME_HEIGHT, FRAMES_PER_STEP
-from model.config import MEMORY_SIZE, BATCH_SIZE, GAMMA, UPDATE_TARGET_MODEL_EVERY, SAVE_WEIGHTS_EVERY
-from model.nn import load_or_build_model
-
-EXPERIENCE_FILE = 'experiences.bin'
+from model.config import UPDATE_TARGET_MODEL_EVERY, SAVE_WEIGHTS_EVERY, EXPERIENCE_STORE_DIR, \
+    OFFLINE_EPOCHS, OFFLINE_STEPS_PER_EXPERIENCE, PRIORITIZED_REPLAY
+from model.experience_store import ExperienceReader
+from model.nn import load_or_build_model, train_minibatch, build_target_model
+from model.offline_pipeline import OfflineBatchStream
+from model.target_cache import TargetQCache
+from model.checkpoints import CheckpointWriter
 
 ## ==================================================================
 ## Model Trainer Entry
 ## ==================================================================
 
-def model_trainer_entry_from_file():
+def model_trainer_entry_from_file(path=EXPERIENCE_STORE_DIR, epochs=OFFLINE_EPOCHS,
+                                  steps_per_experience=OFFLINE_STEPS_PER_EXPERIENCE, prioritized=PRIORITIZED_REPLAY):
 
     model = load_or_build_model()
-    target_model = load_or_build_model()
-    memory = deque(maxlen=MEMORY_SIZE)
-    frame_count = 0
-
-    with open(EXPERIENCE_FILE, "rb") as f:
-        while True:
-
-            # Read the experience to the file
-            prev_frames = f.read(FRAME_WIDTH * FRAME_HEIGHT * FRAMES_PER_STEP)
-            if not prev_frames:
-                break
-            prev_action_index = unpack('i', f.read(calcsize('i')))[0]
-            reward = unpack('f', f.read(calcsize('f')))[0]
-            frames_array = f.read(FRAME_WIDTH * FRAME_HEIGHT * FRAMES_PER_STEP)
-            done = unpack('i', f.read(calcsize('i')))[0]
-            
-            prev_frames = np.frombuffer(prev_frames, dtype=np.uint8).reshape((1, FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP))
-            frames_array = np.frombuffer(frames_array, dtype=np.uint8).reshape((1, FRAME_HEIGHT, FRAME_WIDTH, FRAMES_PER_STEP))
-    
-            # Increment the frame count
-            frame_count += 1
-
-            # Add the experience to the memory
-            memory.append((prev_frames, prev_action_index, reward, frames_array, done))
-
-            # Check if we can replay
-            if len(memory) > BATCH_SIZE:
-                minibatch = random.sample(memory, BATCH_SIZE)
-                for state, action, reward, next_state, done in minibatch:
-                    target = reward
-                    if not done:
-                        # Use target_model for the Q-value prediction
-                        target = (reward + GAMMA * np.amax(target_model.predict(next_state)[0]))
-                    target_f = model.predict(state)
-                    target_f[0][action] = target
-                    model.train_on_batch(state, target_f)
+    target_model = build_target_model(model)
+    target_cache = TargetQCache() # target max Q per experience id, valid until the next target sync
+
+    # Minibatches are read from the memory-mapped store and assembled on a background thread
+    experiences = ExperienceReader(path)
+    stream = OfflineBatchStream(experiences, epochs, steps_per_experience, prioritized=prioritized).start()
+    print(f"Loaded {len(experiences)} experiences from {path}, training {len(stream)} steps")
+
+    checkpoints = CheckpointWriter()
+    train_count = checkpoints.last_step # continue the step count of the resumed checkpoint
+    losses = []
+    try:
+        for ids, minibatch, weights in stream:
+            loss, td_errors = train_minibatch(model, target_model, *minibatch, ids=ids, target_cache=target_cache,
+                                              sample_weight=weights)
+            stream.update_priorities(ids, td_errors)
+            losses.append(loss)
+            train_count += 1
 
             # Update the target model
-            if frame_count % UPDATE_TARGET_MODEL_EVERY == 0:
+            if train_count % UPDATE_TARGET_MODEL_EVERY == 0:
                 # Copy weights from model to target_model
                 target_model.set_weights(model.get_weights())
+                target_cache.invalidate()
+                print(target_cache.format_stats())
 
-            # Sync weights with the model collector
-            if frame_count % SAVE_WEIGHTS_EVERY == 0:
-                model.save_weights(f"model_weights_{frame_count}.h5")
+            # Checkpoint in the background, scored by the recent loss
+            if train_count % SAVE_WEIGHTS_EVERY == 0:
+                checkpoints.save(train_count, model.get_weights(), score=-float(np.mean(losses)))
+                losses = []
+    finally:
+        stream.stop()
+        checkpoints.close()
 
 if __name__ == '__main__':
-    model_trainer_entry_from_file()
+    parser = argparse.ArgumentParser(description="Train the model from recorded experiences")
+    parser.add_argument("--path", default=EXPERIENCE_STORE_DIR, help="experience store directory")
+    parser.add_argument("--epochs", type=int, default=OFFLINE_EPOCHS, help="passes over the recording")
+    parser.add_argument("--steps-per-experience", type=int, default=OFFLINE_STEPS_PER_EXPERIENCE,
+                        help="minibatches trained for each experience read")
+    parser.add_argument("--uniform", action="store_true", help="sample minibatches uniformly instead of by TD error")
+    args = parser.parse_args()
+    model_trainer_entry_from_file(args.path, args.epochs, args.steps_per_experience,
+                                  PRIORITIZED_REPLAY and not args.uniform)
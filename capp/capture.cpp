@@ -29,6 +29,10 @@ const char* const TARGET_WINDOW_NAME = "MapleStory";
 
 const int CAPTURE_TARGET_FPS = 24;
 
+// Send XOR deltas between keyframes, false for the standalone frame format
+const bool DELTA_FRAMES = true;
+const int KEYFRAME_INTERVAL = CAPTURE_TARGET_FPS; // frames, one keyframe per second
+
 // ==================================================================
 // Global Variables
 // ==================================================================
@@ -137,10 +141,40 @@ void fillPacketWithKeys(FramePacket &packet, const std::set<KeyboardInput> &pres
     }
 }
 
+void sendFramePacket(SOCKET sock, const sockaddr_in& server_address, const FramePacket& packet, std::vector<char>& fragment) {
+    const char* bytes = reinterpret_cast<const char*>(&packet);
+    size_t totalLength = FRAME_PACKET_HEADER_SIZE + packet.length;
+
+    // Small enough for a single datagram
+    if (totalLength <= MAX_DATAGRAM_SIZE) {
+        udp_send_to_server(sock, server_address, bytes, totalLength);
+        return;
+    }
+
+    // Split into fragments, the server reassembles them by frame number
+    FragmentHeader header;
+    header.magic = FRAGMENT_MAGIC;
+    header.fragmentCount = static_cast<uint16_t>((totalLength + FRAGMENT_DATA_SIZE - 1) / FRAGMENT_DATA_SIZE);
+    header.frameNumber = packet.frameNumber;
+    header.totalLength = static_cast<uint32_t>(totalLength);
+    for (uint16_t i = 0; i < header.fragmentCount; ++i) {
+        size_t offset = static_cast<size_t>(i) * FRAGMENT_DATA_SIZE;
+        size_t size = std::min(static_cast<size_t>(FRAGMENT_DATA_SIZE), totalLength - offset);
+        header.fragmentIndex = i;
+        header.offset = static_cast<uint32_t>(offset);
+        std::memcpy(fragment.data(), &header, sizeof(header));
+        std::memcpy(fragment.data() + sizeof(header), bytes + offset, size);
+        udp_send_to_server(sock, server_address, fragment.data(), sizeof(header) + size);
+    }
+}
+
 void send_loop(int sock, sockaddr_in server_address, int x, int y, int w, int h) {
     try {
 
-        FramePacket packet = { 0 };
+        // On the heap, the packet can hold a frame much larger than a datagram
+        std::unique_ptr<FramePacket> packetBuffer(new FramePacket());
+        FramePacket& packet = *packetBuffer;
+        std::vector<char> fragment(sizeof(FragmentHeader) + FRAGMENT_DATA_SIZE);
         ScreenCapturer capturer(x, y, w, h);
 
         packet.frameNumber = 0;
@@ -149,6 +183,9 @@ void send_loop(int sock, sockaddr_in server_address, int x, int y, int w, int h)
         cv::Mat capturedImage;
         cv::Mat resizedImage(FRAME_HEIGHT, FRAME_WIDTH, CV_8UC4);
         std::vector<unsigned char> data4bit(FRAME_WIDTH * FRAME_HEIGHT / 2); // 4 bit
+        std::vector<unsigned char> previous4bit(data4bit.size()); // last frame sent
+        std::vector<unsigned char> delta4bit(data4bit.size());
+        int framesSinceKeyframe = KEYFRAME_INTERVAL; // start with a keyframe
         std::pair<cv::Point, cv::Point> minimap = std::make_pair(cv::Point(0,0), cv::Point(0,0));
 
         // FPS values
@@ -211,17 +248,30 @@ void send_loop(int sock, sockaddr_in server_address, int x, int y, int w, int h)
             // Convert to 4 bit
             convertTo4BitBytes(resizedImage, data4bit);  
 
-            // Compress bytes
+            // Compress the delta to the previous frame, or the frame itself on keyframes
+            // and when the delta does not fit
             uLongf length = MAX_BUFFER_SIZE;
-            if (compress(&packet.data[0], &length, &data4bit[0], data4bit.size()) != Z_OK) {
+            bool keyframe = !DELTA_FRAMES || framesSinceKeyframe >= KEYFRAME_INTERVAL;
+            if (!keyframe) {
+                xorBytes(data4bit, previous4bit, delta4bit);
+                if (compress(&packet.data[0], &length, &delta4bit[0], delta4bit.size()) != Z_OK) {
+                    keyframe = true; // delta larger than the frame buffer
+                    length = MAX_BUFFER_SIZE;
+                }
+            }
+            if (keyframe && compress(&packet.data[0], &length, &data4bit[0], data4bit.size()) != Z_OK) {
                 std::cerr << "Compression failed!" << std::endl;
+                framesSinceKeyframe = KEYFRAME_INTERVAL; // the next delta would refer to an unsent frame
                 continue;
             }
             packet.length = length;
+            packet.version = DELTA_FRAMES ? FRAME_VERSION_DELTA : FRAME_VERSION_STANDALONE;
+            packet.flags = !DELTA_FRAMES ? 0 : keyframe ? FRAME_FLAG_KEYFRAME : FRAME_FLAG_DELTA;
+            framesSinceKeyframe = keyframe ? 1 : framesSinceKeyframe + 1;
+            previous4bit.swap(data4bit);
 
             // Send the frame             
-            udp_send_to_server(sock, server_address, reinterpret_cast<const char*>(&packet), 
-            FRAME_PACKET_HEADER_SIZE + packet.length);
+            sendFramePacket(sock, server_address, packet, fragment);
 
             // Wait until next frame
             auto frameEndTime = std::chrono::high_resolution_clock::now();
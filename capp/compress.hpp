@@ -15,6 +15,13 @@ std::vector<unsigned char> compressBytes(const std::vector<unsigned char>& data)
     return compressedData;
 }
 
+// Byte-wise XOR of two equally sized buffers, a delta frame against the previous frame
+void xorBytes(const std::vector<unsigned char>& a, const std::vector<unsigned char>& b, std::vector<unsigned char>& output) {
+    for (size_t i = 0; i < output.size(); ++i) {
+        output[i] = a[i] ^ b[i];
+    }
+}
+
 std::vector<unsigned char> decompressBytes(const std::vector<unsigned char>& compressedData, uLong originalSize) {
     std::vector<unsigned char> decompressedData(originalSize);
 
@@ -6,10 +6,21 @@ const int FRAME_WIDTH = 512; //640;
 const int FRAME_HEIGHT = 288; //360;
 
 const size_t MAX_PORTALS = 8;
-const int MAX_BUFFER_SIZE = 65000;
+const int MAX_BUFFER_SIZE = 1 << 20; // compressed frame bytes
+const int MAX_DATAGRAM_SIZE = 65000 + 120; // larger frame packets are sent as fragments
+const int FRAGMENT_DATA_SIZE = 16384; // frame packet bytes per fragment
 const size_t MAX_PRESSED_KEYS = 16;
 const char NO_KEY_VALUE = 0;
 
+// Frame encoding, carried in the header bytes that used to be padding
+// - Version 0: every frame is a standalone 4-bit image (the padding was zero)
+// - Version 1: keyframes are 4-bit images, delta frames are the XOR of the
+//   4-bit image with the one of frameNumber - 1, both zlib compressed
+const uint8_t FRAME_VERSION_STANDALONE = 0;
+const uint8_t FRAME_VERSION_DELTA = 1;
+const uint8_t FRAME_FLAG_KEYFRAME = 1 << 0;
+const uint8_t FRAME_FLAG_DELTA = 1 << 1;
+
 struct Metrics {
     float hp;
     float mp;
@@ -44,6 +55,9 @@ struct KeyboardInput {
 struct FramePacket {
     Metrics metrics;
     Minimap minimap;
+    uint8_t version;
+    uint8_t flags;
+    uint16_t reserved;
     uint64_t frameNumber;
     
     KeyboardInput pressedKeys[MAX_PRESSED_KEYS];
@@ -54,6 +68,20 @@ struct FramePacket {
 };
 
 const int FRAME_PACKET_HEADER_SIZE = sizeof(FramePacket) - MAX_BUFFER_SIZE;
+static_assert(FRAME_PACKET_HEADER_SIZE == 120, "FramePacket header layout changed, update actpy/model/protocol.py");
+
+// From client to server, for a frame packet larger than MAX_DATAGRAM_SIZE:
+// the header is followed by bytes [offset, offset + size) of the packet
+const uint32_t FRAGMENT_MAGIC = 0x47415246; // "FRAG", never a valid hp
+struct FragmentHeader {
+    uint32_t magic;
+    uint16_t fragmentIndex;
+    uint16_t fragmentCount;
+    uint64_t frameNumber;
+    uint32_t totalLength; // frame packet bytes, header included
+    uint32_t offset;
+};
+static_assert(sizeof(FragmentHeader) == 24, "FragmentHeader layout changed, update actpy/model/protocol.py");
 
 // From server to client
 struct ActionPacket {